@@ -1,13 +1,17 @@
 from django.contrib import admin
 from import_export import fields
 from import_export.admin import ImportExportModelAdmin
+from chat.search import build_search_query
 from .models import (
     Ticket,
     TicketDetail,
     Profile,
     Chat,
     ChatMembership,
-    Message
+    ChatUnreadCounter,
+    Message,
+    MessageArchive,
+    VoiceNote
 )
 
 @admin.register(Profile)
@@ -28,9 +32,14 @@ class ChatAdmin(admin.ModelAdmin):
         'name',
         'creator',
         'member_count',
+        'message_count',
+        'last_activity_at',
         'is_active',
         'created_at',
     )
+    list_select_related = (
+        'creator',
+    )
     search_fields = (
         'name',
         'creator__username',
@@ -66,8 +75,60 @@ class MessageAdmin(admin.ModelAdmin):
     )
     search_fields = (
         'sender__username',
-        'content',
     )
     ordering = ('-sent_at',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # جستجوی محتوا از همان ایندکس GIN جستجوی کاربران، به جای ILIKE روی content.
+        # دو شرط با OR در یک WHERE نمی‌آیند (ایندکس GIN استفاده نمی‌شد)؛ هر کدام
+        # کوئری جدای خودش است و id ها با UNION یکی می‌شوند
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        by_sender, _ = super().get_search_results(request, queryset, search_term)
+        by_content = queryset.filter(search_vector=build_search_query(search_term))
+        matching_ids = by_sender.order_by().values('pk').union(by_content.order_by().values('pk'))
+        return queryset.filter(pk__in=matching_ids), False
+
+@admin.register(ChatUnreadCounter)
+class ChatUnreadCounterAdmin(admin.ModelAdmin):
+    list_display = (
+        'chat',
+        'user',
+        'unread_count',
+    )
+    search_fields = (
+        'user__username',
+        'chat__name',
+    )
+    raw_id_fields = (
+        'chat',
+        'user',
+        'last_message',
+    )
+
+@admin.register(VoiceNote)
+class VoiceNoteAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'uploader',
+        'content_type',
+        'size',
+        'duration_ms',
+    )
+    search_fields = (
+        'uploader__username',
+    )
+    raw_id_fields = (
+        'uploader',
+    )
 
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = (
+        'partition',
+        'period_start',
+        'period_end',
+        'compression',
+        'row_count',
+    )
+    ordering = ('-period_start',)
@@ -8,4 +8,7 @@ class TicketConfig(AppConfig):
 
     def ready(self) -> None:
         import chat.signals
+        from django.db.backends.signals import connection_created
+        from chat.metrics import install_query_wrapper
+        connection_created.connect(install_query_wrapper, dispatch_uid='chat_metrics_query_wrapper')
         
\ No newline at end of file
@@ -0,0 +1,223 @@
+import gzip
+import json
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import prefetch_related_objects
+from django.utils.dateparse import parse_datetime
+
+PARTITION_PREFIX = 'chat_message_p'
+DEFAULT_PARTITION = 'chat_message_default'
+ARCHIVE_CHUNK_ROWS = 50_000
+# پیام‌های هر بلوک مستقل فشرده (یک بلوک ≈ یک یا دو صفحه‌ی تاریخچه)
+ARCHIVE_BLOCK_ROWS = 200
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(value):
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+def previous_month(value):
+    if value.month == 1:
+        return value.replace(year=value.year - 1, month=12)
+    return value.replace(month=value.month - 1)
+
+def partition_name(period_start):
+    return f"{PARTITION_PREFIX}{period_start:%Y%m}"
+
+def partition_bounds(name):
+    """chat_message_p202401 -> (2024-01-01, 2024-02-01) به UTC"""
+    start = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m').replace(tzinfo=dt_timezone.utc)
+    return start, next_month(start)
+
+def archive_compression():
+    """zstd اگر zstandard نصب باشد، در غیر این صورت gzip"""
+    preferred = getattr(settings, 'CHAT_ARCHIVE_COMPRESSION', None)
+    if preferred:
+        return preferred
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return 'gzip'
+    return 'zstd'
+
+def archived_columns():
+    """ستون‌های آرشیو؛ search_vector قابل بازسازی است و ذخیره نمی‌شود"""
+    from chat.models import Message
+    return [
+        field.column for field in Message._meta.concrete_fields
+        if field.name != 'search_vector'
+    ]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Partitions
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def is_partitioned(cursor, table='chat_message'):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+def list_partitions(cursor, table='chat_message'):
+    """پارتیشن‌های ماهانه‌ی متصل، به ترتیب زمانی (پارتیشن DEFAULT شامل نمی‌شود)"""
+    cursor.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s) AND child.relname LIKE %s
+        ORDER BY child.relname
+        """,
+        [table, PARTITION_PREFIX + '%'],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def create_month_partition(cursor, period_start, table='chat_message'):
+    name = partition_name(period_start)
+    qn = connection.ops.quote_name
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(table)} "
+        f"FOR VALUES FROM (%s) TO (%s)",
+        [period_start, next_month(period_start)],
+    )
+    return name
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Archive files
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def compress_block(data, compression):
+    """
+    هر بلوک یک frame (zstd) یا member (gzip) مستقل است؛ الحاق آن‌ها هم
+    یک فایل معتبر JSONL فشرده است و هر بلوک جدا هم باز می‌شود
+    """
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+def decompress_block(data, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+def export_partition(partition, fileobj, compression):
+    """
+    ردیف‌های پارتیشن را به ترتیب (chat_id, sent_at, id) به صورت JSONL فشرده می‌نویسد.
+    خروجی (row_count, blocks) است؛ blocks ایندکس هر چت (MessageArchiveBlock) است:
+    chat_id، بازه‌ی sent_at و offset/length بلوک در فایل.
+    """
+    import pandas as pd
+    from chat.models import Message
+
+    qn = connection.ops.quote_name
+    columns = archived_columns()
+    # uuidها به صورت رشته در JSON نوشته می‌شوند
+    key_columns = [
+        field.column for field in Message._meta.concrete_fields
+        if (field.primary_key or field.is_relation) and field.column in columns
+    ]
+    sql = (
+        f"SELECT {', '.join(qn(column) for column in columns)} FROM {qn(partition)} "
+        f"ORDER BY chat_id, sent_at, id"
+    )
+    row_count = 0
+    blocks = []
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(ARCHIVE_CHUNK_ROWS)
+            if not rows:
+                break
+            frame = pd.DataFrame.from_records(rows, columns=columns)
+            for column in key_columns:
+                frame[column] = frame[column].map(lambda value: str(value) if value is not None else None)
+            for chat_id, chat_rows in frame.groupby('chat_id', sort=False):
+                for start in range(0, len(chat_rows), ARCHIVE_BLOCK_ROWS):
+                    block = chat_rows.iloc[start:start + ARCHIVE_BLOCK_ROWS]
+                    lines = block.to_json(orient='records', lines=True, date_format='iso', date_unit='us')
+                    data = compress_block((lines.rstrip('\n') + '\n').encode('utf-8'), compression)
+                    blocks.append({
+                        'chat_id': chat_id,
+                        'first_sent_at': pd.Timestamp(block['sent_at'].iloc[0]).to_pydatetime(),
+                        'last_sent_at': pd.Timestamp(block['sent_at'].iloc[-1]).to_pydatetime(),
+                        'offset': fileobj.tell(),
+                        'length': len(data),
+                        'row_count': len(block),
+                    })
+                    fileobj.write(data)
+            row_count += len(frame)
+    return row_count, blocks
+
+def read_block(fileobj, block, compression):
+    """ردیف‌های یک بلوک با seek؛ بقیه‌ی فایل خوانده نمی‌شود"""
+    fileobj.seek(block.offset)
+    data = decompress_block(fileobj.read(block.length), compression)
+    return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Lazy archive reads
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def message_from_row(row):
+    from chat.models import Message
+    row = {key: (None if value != value else value) for key, value in row.items()}  # NaN -> None
+    values = {}
+    for field in Message._meta.concrete_fields:
+        if field.column not in row:
+            continue
+        value = row[field.column]
+        if isinstance(field, models.DateTimeField) and isinstance(value, str):
+            value = parse_datetime(value)
+        values[field.attname] = value
+    return Message(**values)
+
+def has_archived_messages(chat_id):
+    """یک index lookup روی chat_archive_block_idx"""
+    from chat.models import MessageArchiveBlock
+    return MessageArchiveBlock.objects.filter(chat_id=chat_id).exists()
+
+def load_archived_messages(chat_id, before, limit):
+    """
+    قدیمی‌ترین پیام‌های چت که دیگر در chat_message نیستند.
+    با ایندکس MessageArchiveBlock فقط بلوک‌های همین چت قبل از cursor (معمولا
+    یکی دو بلوک) خوانده می‌شوند، نه کل فایل ماه. خروجی از جدید به قدیم است.
+    """
+    from chat.models import MessageArchiveBlock
+
+    blocks = MessageArchiveBlock.objects.filter(
+        chat_id=chat_id
+    ).select_related('archive').order_by('-first_sent_at')
+    if before is not None:
+        blocks = blocks.filter(first_sent_at__lte=before[0])
+
+    messages = []
+    files = {}
+    try:
+        for block in blocks.iterator():
+            archive = block.archive
+            if archive.pk not in files:
+                files[archive.pk] = archive.file.open('rb')
+            rows = [message_from_row(row) for row in read_block(files[archive.pk], block, archive.compression)]
+            if before is not None:
+                sent_at, pk = before
+                rows = [
+                    message for message in rows
+                    if (message.sent_at, str(message.id)) < (sent_at, str(pk))
+                ]
+            rows.sort(key=lambda message: (message.sent_at, str(message.id)), reverse=True)
+            messages.extend(rows[:limit + 1 - len(messages)])
+            if len(messages) > limit:
+                break
+    finally:
+        for fileobj in files.values():
+            fileobj.close()
+
+    prefetch_related_objects(messages, 'sender__profile_chat', 'reply_to', 'forward_from', 'voice')
+    return messages
@@ -0,0 +1,85 @@
+import asyncio
+from channels.db import database_sync_to_async
+from chat.fanout import get_fanout
+from chat.metrics import timed
+from chat.replay import get_replay_buffer
+from chat.models import Message
+from chat.persistence import (
+    build_message_row,
+    get_writer,
+    write_behind_enabled,
+    )
+from chat.sequence import get_allocator
+from chat.serializers import MessageRealtimeSerializer
+from chat.utils import chat_group_name
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@database_sync_to_async
+def create_message(chat_id, user, content, voice_id):
+    message = Message.objects.create(
+        chat_id=chat_id,
+        sender=user,
+        content=content,
+        voice_id=voice_id
+    )
+    return MessageRealtimeSerializer.to_dict(message)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Publish
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+async def store_message(chat_id, user, content=None, voice_id=None):
+    """ذخیره (یا تحویل به writer) و برگرداندن payload realtime"""
+    if write_behind_enabled():
+        # ارسال فوری؛ ذخیره به صورت batch در writer انجام می‌شود. seq با INCR روی
+        # Redis گرفته می‌شود؛ بدون Redis خالی می‌ماند و write_messages برای کل
+        # batch یک بار رزرو می‌کند (این پیام‌ها در replay buffer نمی‌آیند)
+        allocator = get_allocator()
+        seq = None
+        if allocator.enabled:
+            seq = (await allocator.allocate_async({chat_id: 1})).get(str(chat_id))
+        row = build_message_row(chat_id, user.pk, content, voice_id, seq)
+        await get_writer().submit(row)
+        return MessageRealtimeSerializer.from_row(row)
+    return await create_message(chat_id, user, content, voice_id)
+
+async def send_chat_frame(channel_layer, chat_id, frame):
+    """
+    هر رویداد چت (پیام، presence، typing) از هر دو مسیر فرستاده می‌شود: گروه
+    chat_<id> و fan-out محلی. هر سوکت فقط در یکی از این دو است (بر اساس
+    is_broadcast_chat در لحظه‌ی اتصال)، پس هر frame دقیقا یک بار می‌رسد؛ حتی
+    وقتی چت از CHAT_BROADCAST_MIN_MEMBERS عبور کرده و سوکت‌های قدیمی و جدید
+    حالت متفاوتی دارند. هزینه‌ی مسیر خالی یک PUBLISH یا group_send بدون عضو است.
+    """
+    event = {
+        'type': 'chat_message',
+        'chat_id': str(chat_id),
+        'frame': frame,
+    }
+    await asyncio.gather(
+        channel_layer.group_send(chat_group_name(chat_id), event),
+        get_fanout().publish(chat_id, frame),
+    )
+
+async def broadcast_message(channel_layer, chat_id, message):
+    """
+    frame فقط یک بار encode می‌شود و consumerها آن را بدون تغییر می‌فرستند
+    """
+    with timed('serialize'):
+        frame = MessageRealtimeSerializer.encode(message)
+    if message.get('seq') is not None:
+        # برای resume سوکت‌هایی که قطع شده‌اند
+        await get_replay_buffer().append(chat_id, message['seq'], frame)
+    with timed('send'):
+        await send_chat_frame(channel_layer, chat_id, frame)
+
+async def broadcast_messages(channel_layer, messages):
+    """
+    ارسال هم‌زمان چند پیام در چند چت (مثلا فوروارد گروهی) در یک گذر؛
+    messages لیستی از (chat_id, payload) است
+    """
+    await asyncio.gather(*(
+        broadcast_message(channel_layer, chat_id, payload)
+        for chat_id, payload in messages
+    ))
@@ -1,66 +1,490 @@
+import asyncio
 import json
+import mimetypes
+import uuid
+from django.conf import settings
+from django.core.files import File
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from chat.serializers import MessageRealtimeSerializer
-from .models import Chat, Message
+from chat.broadcast import broadcast_message, send_chat_frame, store_message
+from chat.fanout import get_fanout, is_broadcast_chat
+from chat.frames import VoiceAssembler, parse_voice_frame
+from chat.media import voice_max_bytes
+from chat.membership import MembershipSnapshot
+from chat.metrics import instrument_receive
+from chat.presence import get_presence
+from chat.replay import missed_frames
+from chat.utils import chat_group_name, membership_event_affects, user_group_name
+from .models import ChatMembership, Message, VoiceNote
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def user_owns_voice(user, voice_id):
+    try:
+        return VoiceNote.objects.filter(id=voice_id, uploader=user).exists()
+    except (ValueError, ValidationError):
+        return False
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Chat events (مشترک بین ChatConsumer و UserConsumer)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ChatEventsMixin:
+    """
+    رویدادهای وابسته به چت (پیام، read، typing، presence و فریم باینری صوت)
+    با chat_id صریح. ChatConsumer همیشه چت خودش را می‌دهد و UserConsumer چتی
+    که در خود رویداد آمده؛ is_chat_member را هر consumer پیاده می‌کند.
+    """
+    def setup_chat_events(self):
+        self.voice_assembler = VoiceAssembler(voice_max_bytes())
+        self.pending_reads = {}
+        self.read_flush_task = None
+        self.presence = get_presence()
+        self.present_chats = set()
+        self.heartbeat_task = None
+
+    async def teardown_chat_events(self):
+        if hasattr(self, 'voice_assembler'):
+            self.voice_assembler.clear()
+        if getattr(self, 'read_flush_task', None) is not None:
+            self.read_flush_task.cancel()
+            self.read_flush_task = None
+        if getattr(self, 'pending_reads', None):
+            await self.flush_reads()
+        if getattr(self, 'heartbeat_task', None) is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        for chat_id in list(getattr(self, 'present_chats', ())):
+            await self.leave_presence(chat_id)
+
+    # -----------------------------------
+    # Messages
+    # -----------------------------------
+    async def receive_message(self, chat_id, message_text, voice_id):
+        # صوت قبلا از voices/ آپلود شده و اینجا فقط شناسه‌اش می‌آید
+        if not message_text and not voice_id:
+            return
+        if voice_id and not await self.owns_voice(voice_id):
+            return
+        await self.publish_message(chat_id, message_text, voice_id)
+
+    async def publish_message(self, chat_id, message_text, voice_id=None):
+        message_obj = await store_message(chat_id, self.user, message_text, voice_id)
+        await broadcast_message(self.channel_layer, chat_id, message_obj)
+
+    async def receive_voice_frame(self, bytes_data):
+        """
+        فریم باینری صوت: header ثابت (شامل chat_id) + تکه‌ی صوت. تکه‌ها به ترتیب
+        seq سرهم می‌شوند و با تکه‌ی آخر، فایل ذخیره و فقط ارجاع آن broadcast می‌شود.
+        """
+        try:
+            frame = parse_voice_frame(bytes_data)
+            if not self.is_chat_member(frame.chat_id):
+                raise ValueError("voice frame for another chat")
+            upload = self.voice_assembler.add(frame)
+        except ValueError:
+            return
+
+        if upload is None:
+            return
+
+        try:
+            voice = await self.save_voice(upload)
+        finally:
+            upload.close()
+
+        await self.send(text_data=json.dumps({
+            'type': 'voice_ack',
+            'chat': str(frame.chat_id),
+            'client_message_id': str(frame.client_message_id),
+            'voice': str(voice.id),
+        }))
+        await self.publish_message(str(frame.chat_id), None, voice.id)
+
+    # -----------------------------------
+    # Read receipts
+    # -----------------------------------
+    async def receive_read(self, chat_id, message_id):
+        """
+        رویداد read با debounce: برای هر چت فقط آخرین message_id بعد از
+        CHAT_READ_DEBOUNCE_MS ذخیره می‌شود
+        """
+        if not message_id:
+            return
+        self.pending_reads[str(chat_id)] = message_id
+        if self.read_flush_task is None:
+            self.read_flush_task = asyncio.get_running_loop().create_task(self.flush_reads_later())
+
+    async def flush_reads_later(self):
+        await asyncio.sleep(getattr(settings, 'CHAT_READ_DEBOUNCE_MS', 1000) / 1000)
+        self.read_flush_task = None
+        await self.flush_reads()
+
+    async def flush_reads(self):
+        pending, self.pending_reads = self.pending_reads, {}
+        for chat_id, message_id in pending.items():
+            try:
+                await database_sync_to_async(ChatMembership.advance_read_cursor)(
+                    chat_id, self.user.pk, message_id
+                )
+            except (ValueError, ValidationError):
+                pass
+
+    # -----------------------------------
+    # Presence / Typing
+    # -----------------------------------
+    async def join_presence(self, chat_id):
+        chat_id = str(chat_id)
+        if self.presence is None or chat_id in self.present_chats:
+            return
+        self.present_chats.add(chat_id)
+        if await self.presence.connect(self.user.pk, chat_id, self.channel_name):
+            await self.broadcast_presence(chat_id, True)
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.get_running_loop().create_task(self.heartbeat())
+
+    async def leave_presence(self, chat_id):
+        chat_id = str(chat_id)
+        if chat_id not in self.present_chats:
+            return
+        self.present_chats.discard(chat_id)
+        if await self.presence.disconnect(self.user.pk, chat_id, self.channel_name):
+            await self.broadcast_presence(chat_id, False)
+
+    async def heartbeat(self):
+        interval = max(self.presence.ttl / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            for chat_id in list(self.present_chats):
+                await self.presence.heartbeat(self.user.pk, chat_id, self.channel_name)
+
+    async def broadcast_presence(self, chat_id, online):
+        await send_chat_frame(self.channel_layer, chat_id, json.dumps({
+            'type': 'presence',
+            'chat': str(chat_id),
+            'user_id': str(self.user.pk),
+            'online': online,
+        }))
+
+    async def receive_typing(self, chat_id):
+        """
+        typing در Redis ثبت می‌شود؛ فقط سوکتی که قفل بازه را می‌گیرد بعد از
+        CHAT_TYPING_INTERVAL_MS یک رویداد تجمیعی برای کل چت می‌فرستد
+        """
+        if self.presence is None:
+            return
+        if await self.presence.typing(chat_id, self.user.pk):
+            asyncio.get_running_loop().create_task(self.flush_typing(chat_id))
+
+    async def flush_typing(self, chat_id):
+        await asyncio.sleep(self.presence.typing_interval_ms / 1000)
+        users = await self.presence.typing_members(chat_id)
+        if users:
+            await send_chat_frame(self.channel_layer, chat_id, json.dumps({
+                'type': 'typing',
+                'chat': str(chat_id),
+                'users': users,
+            }))
+
+    # -----------------------------------
+    # Resume
+    # -----------------------------------
+    async def send_missed(self, chat_id, frames, truncated):
+        for frame in frames:
+            await self.send(text_data=frame)
+        await self.send(text_data=json.dumps({
+            'type': 'resumed',
+            'chat': str(chat_id),
+            'truncated': truncated,
+        }))
+
+    # -----------------------------------
+    # Voice
+    # -----------------------------------
+    async def owns_voice(self, voice_id):
+        return await database_sync_to_async(user_owns_voice)(self.user, voice_id)
+
+    @database_sync_to_async
+    def save_voice(self, upload):
+        voice = VoiceNote(
+            uploader=self.user,
+            content_type=upload.codec,
+            size=upload.size,
+        )
+        extension = mimetypes.guess_extension(upload.codec) or '.bin'
+        voice.file.save(f'{uuid.uuid4().hex}{extension}', File(upload.file), save=False)
+        voice.save()
+        return voice
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Chat Consumer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ChatConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.chat_id = self.scope['url_route']['kwargs']['chat_id']
-        self.chat_group_name = f'chat_{self.chat_id}'
+        self.chat_group_name = chat_group_name(self.chat_id)
+        self.user = self.scope['user']
 
+        # چت و عضویت (snapshot) فقط یک بار برای کل عمر سوکت خوانده می‌شود
+        self.membership = await self.resolve_membership()
+        if self.membership is None:
+            return await self.close()
+        self.chat = self.membership.chat
+
+        # رویدادهای عضویت فقط به گروه کاربر فرستاده می‌شوند
+        self.user_group_name = user_group_name(self.user.pk)
         await self.channel_layer.group_add(
-            self.chat_group_name,
+            self.user_group_name,
             self.channel_name
         )
+        # کانال‌ها و گروه‌های بزرگ رویدادها را از fan-out محلی worker می‌گیرند و
+        # بقیه از گروه چت؛ فرستنده همیشه به هر دو می‌فرستد (send_chat_frame)
+        self.use_broadcast = is_broadcast_chat(self.chat.chat_type, self.chat.member_count)
+        if self.use_broadcast:
+            await get_fanout().register(self.chat.id, self)
+        else:
+            await self.channel_layer.group_add(
+                self.chat_group_name,
+                self.channel_name
+            )
 
+        self.setup_chat_events()
         await self.accept()
+        await self.join_presence(self.chat.id)
 
     async def disconnect(self, close_code):
+        await self.teardown_chat_events()
+        if not hasattr(self, 'use_broadcast'):
+            return
         await self.channel_layer.group_discard(
-            self.chat_group_name,
+            self.user_group_name,
             self.channel_name
         )
+        if self.use_broadcast:
+            await get_fanout().unregister(self.chat.id, self)
+        else:
+            await self.channel_layer.group_discard(
+                self.chat_group_name,
+                self.channel_name
+            )
+
+    def is_chat_member(self, chat_id):
+        return self.membership is not None and str(chat_id) == str(self.chat.id)
+
+    @instrument_receive
+    async def receive(self, text_data=None, bytes_data=None):
+        # بررسی اینکه کاربر عضو چت هست (از کش سوکت)
+        if self.membership is None:
+            return await self.close()
+
+        if bytes_data is not None:
+            return await self.receive_voice_frame(bytes_data)
 
-    async def receive(self, text_data):
         data = json.loads(text_data)
-        message_text = data.get('message')
-        user = self.scope['user']
-        voice_data = data.get('voice')
+        if data.get('type') == 'read':
+            return await self.receive_read(self.chat.id, data.get('message_id'))
+        if data.get('type') == 'typing':
+            return await self.receive_typing(self.chat.id)
+        if data.get('type') == 'resume':
+            return await self.receive_resume(data.get('seq'))
+
+        await self.receive_message(self.chat.id, data.get('message'), data.get('voice'))
 
-        if not message_text and not voice_data:
+    async def receive_resume(self, seq):
+        """
+        کلاینت بعد از اتصال دوباره آخرین seq دیده شده را می‌فرستد و
+        پیام‌های جا مانده از replay buffer (یا دیتابیس) برایش فرستاده می‌شود
+        """
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError):
             return
+        frames, truncated = await missed_frames(self.chat.id, seq)
+        await self.send_missed(self.chat.id, frames, truncated)
 
-        # بررسی اینکه کاربر عضو چت هست
-        chat = await database_sync_to_async(Chat.objects.get)(id=self.chat_id)
-        if not await database_sync_to_async(chat.can_message)(user):
+    async def chat_message(self, event):
+        # frame قبلا یک بار encode شده است
+        await self.send(text_data=event['frame'])
+
+    async def membership_changed(self, event):
+        """
+        پیام کنترلی از Chat.add_member(s) / remove_member(s) / promote_to_admin
+        فقط سوکت‌های همان کاربر در همان چت کش را دوباره می‌خوانند
+        """
+        if event['chat_id'] != str(self.chat.id) or not membership_event_affects(event, self.user.pk):
+            return
+
+        self.membership = await self.resolve_membership()
+        if self.membership is None:
             return await self.close()
+        self.chat = self.membership.chat
 
-        # ذخیره پیام
-        message_obj = await self.create_message(user, message_text, voice_data)
+    @database_sync_to_async
+    def resolve_membership(self):
+        return MembershipSnapshot.load(self.chat_id, self.user)
 
-        # ارسال به گروه
-        await self.channel_layer.group_send(
-            self.chat_group_name,
-            {
-                'type': 'chat_message',
-                'message': message_obj
-            }
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Multiplexed User Consumer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class UserConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    """
+    یک سوکت برای هر session کاربر به جای یک سوکت برای هر چت.
+    لیست چت‌ها یک بار در connect خوانده می‌شود؛ سوکت عضو گروه user_<id>،
+    گروه chat_<id> چت‌های معمولی و fan-out محلی کانال‌ها / گروه‌های بزرگ می‌شود
+    تا هر پیام فقط یک بار برای هر چت ارسال شود. همه‌ی رویدادهای ChatConsumer
+    (پیام، read، typing، presence، فریم صوت) با فیلد chat همین‌جا هم پذیرفته می‌شوند.
+    """
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            return await self.close()
+
+        self.user_group_name = user_group_name(self.user.pk)
+        self.subscriptions = {}
+        self.setup_chat_events()
+
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
         )
+        subscriptions = await self.load_subscriptions()
+        await asyncio.gather(*(
+            self.subscribe(chat_id, membership) for chat_id, membership in subscriptions.items()
+        ))
+        await self.accept()
+
+        await self.send(text_data=json.dumps({
+            'type': 'subscriptions',
+            'chats': list(self.subscriptions),
+        }))
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user_group_name'):
+            return
+        await self.teardown_chat_events()
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
+        await asyncio.gather(*(self.unsubscribe(chat_id) for chat_id in list(self.subscriptions)))
+
+    async def subscribe(self, chat_id, membership):
+        current = self.subscriptions.get(chat_id)
+        if current is not None and current['broadcast'] == membership['broadcast']:
+            self.subscriptions[chat_id] = membership
+            return
+        if current is not None:
+            await self.unsubscribe(chat_id)
+        self.subscriptions[chat_id] = membership
+        if membership['broadcast']:
+            await get_fanout().register(chat_id, self)
+        else:
+            await self.channel_layer.group_add(chat_group_name(chat_id), self.channel_name)
+
+    async def unsubscribe(self, chat_id):
+        membership = self.subscriptions.pop(chat_id, None)
+        if membership is None:
+            return
+        self.pending_reads.pop(chat_id, None)
+        await self.leave_presence(chat_id)
+        if membership['broadcast']:
+            await get_fanout().unregister(chat_id, self)
+        else:
+            await self.channel_layer.group_discard(chat_group_name(chat_id), self.channel_name)
+
+    def is_chat_member(self, chat_id):
+        # عضویت از subscription set سوکت چک می‌شود، نه از دیتابیس
+        return str(chat_id) in self.subscriptions
+
+    @instrument_receive
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            # chat_id در header خود فریم است
+            return await self.receive_voice_frame(bytes_data)
+
+        data = json.loads(text_data)
+        if data.get('type') == 'resume':
+            return await self.receive_resume(data.get('chats'))
+
+        chat_id = str(data.get('chat') or '')
+        if not self.is_chat_member(chat_id):
+            return
+
+        if data.get('type') == 'read':
+            return await self.receive_read(chat_id, data.get('message_id'))
+        if data.get('type') == 'typing':
+            return await self.receive_typing(chat_id)
+        if data.get('type') == 'presence':
+            # کلاینت چتی را که باز کرده اعلام می‌کند؛ مثل باز کردن سوکت همان چت
+            if data.get('online'):
+                return await self.join_presence(chat_id)
+            return await self.leave_presence(chat_id)
+
+        await self.receive_message(chat_id, data.get('message'), data.get('voice'))
+
+    async def receive_resume(self, chats):
+        """{"type": "resume", "chats": {"<chat_id>": <last seq>}} فقط برای چت‌های عضو"""
+        if not isinstance(chats, dict):
+            return
+        resumes = {}
+        for chat_id, seq in chats.items():
+            try:
+                if str(chat_id) in self.subscriptions:
+                    resumes[str(chat_id)] = int(seq)
+            except (TypeError, ValueError):
+                continue
+
+        results = await asyncio.gather(*(
+            missed_frames(chat_id, seq) for chat_id, seq in resumes.items()
+        ))
+        for chat_id, (frames, truncated) in zip(resumes, results):
+            await self.send_missed(chat_id, frames, truncated)
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event['message']))
+        if event['chat_id'] not in self.subscriptions:
+            return
+        # frame شامل chat است و بدون encode دوباره فرستاده می‌شود
+        await self.send(text_data=event['frame'])
+
+    async def membership_changed(self, event):
+        if not membership_event_affects(event, self.user.pk):
+            return
+
+        chat_id = event['chat_id']
+        membership = await self.load_membership(chat_id)
+        if membership is None:
+            await self.unsubscribe(chat_id)
+        else:
+            await self.subscribe(chat_id, membership)
 
     @database_sync_to_async
-    def create_message(self, user, message_text, voice_data):
-        chat = Chat.objects.get(id=self.chat_id)
-        msg = Message.objects.create(
-            chat=chat,
-            sender=user,
-            content=message_text,
-            voice=voice_data
-        )
-        return msg
\ No newline at end of file
+    def load_subscriptions(self):
+        return {
+            str(chat_id): {
+                'is_admin': is_admin,
+                'broadcast': is_broadcast_chat(chat_type, member_count),
+            }
+            for chat_id, is_admin, chat_type, member_count in ChatMembership.objects.filter(
+                user=self.user,
+                is_active=True,
+                chat__is_active=True
+            ).values_list('chat_id', 'is_admin', 'chat__chat_type', 'chat__member_count')
+        }
+
+    @database_sync_to_async
+    def load_membership(self, chat_id):
+        row = ChatMembership.objects.filter(
+            chat_id=chat_id,
+            user=self.user,
+            is_active=True,
+            chat__is_active=True
+        ).values_list('is_admin', 'chat__chat_type', 'chat__member_count').first()
+        if row is None:
+            return None
+        is_admin, chat_type, member_count = row
+        return {
+            'is_admin': is_admin,
+            'broadcast': is_broadcast_chat(chat_type, member_count),
+        }
+
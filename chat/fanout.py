@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from django.conf import settings
+from chat.types import CHAT_TYPE_CHOICES
+
+logger = logging.getLogger(__name__)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def is_broadcast_chat(chat_type, member_count):
+    """
+    کانال‌ها و گروه‌های بزرگ به جای group_send (یک پیام برای هر سوکت در Redis)
+    یک بار publish می‌شوند و هر worker خودش به سوکت‌های محلی می‌فرستد.
+    فقط مسیر دریافت هر سوکت را در لحظه‌ی اتصال تعیین می‌کند؛ فرستنده همیشه
+    از هر دو مسیر می‌فرستد (chat.broadcast.send_chat_frame)
+    """
+    if chat_type == CHAT_TYPE_CHOICES.channel:
+        return True
+    return member_count >= getattr(settings, 'CHAT_BROADCAST_MIN_MEMBERS', 1000)
+
+def fanout_channel(chat_id):
+    return f'chat:fanout:{chat_id}'
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Local Fan-out
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class LocalFanout:
+    """
+    سوکت‌های محلی هر چت در این worker. با redis_url هر پیام یک بار در
+    Redis pub/sub منتشر می‌شود و هر worker فقط به کانال چت‌هایی subscribe
+    می‌کند که سوکت محلی دارند؛ بدون redis_url فقط تحویل درون‌پردازه‌ای است.
+    frame یک بار encode شده و همان رشته برای همه‌ی سوکت‌ها فرستاده می‌شود.
+    """
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url
+        self.local = {}
+        self.redis = None
+        self.pubsub = None
+        self._listener = None
+
+    async def register(self, chat_id, consumer):
+        chat_id = str(chat_id)
+        consumers = self.local.setdefault(chat_id, set())
+        consumers.add(consumer)
+        if len(consumers) == 1 and self.redis_url:
+            await self._ensure_pubsub()
+            await self.pubsub.subscribe(fanout_channel(chat_id))
+
+    async def unregister(self, chat_id, consumer):
+        chat_id = str(chat_id)
+        consumers = self.local.get(chat_id)
+        if not consumers:
+            return
+        consumers.discard(consumer)
+        if not consumers:
+            del self.local[chat_id]
+            if self.pubsub is not None:
+                await self.pubsub.unsubscribe(fanout_channel(chat_id))
+
+    async def publish(self, chat_id, frame):
+        if self.redis_url:
+            await self._ensure_pubsub()
+            await self.redis.publish(fanout_channel(chat_id), frame)
+        else:
+            await self.deliver(str(chat_id), frame)
+
+    async def deliver(self, chat_id, frame):
+        consumers = list(self.local.get(chat_id, ()))
+        if not consumers:
+            return
+        results = await asyncio.gather(
+            *(consumer.send(text_data=frame) for consumer in consumers),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("fan-out send failed: %s", result)
+
+    async def _ensure_pubsub(self):
+        if self.pubsub is not None:
+            return
+        import redis.asyncio as redis
+        self.redis = redis.from_url(self.redis_url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        prefix = fanout_channel('')
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except Exception:
+                logger.exception("fan-out listener error")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message['type'] != 'message':
+                continue
+            channel = message['channel'].decode()
+            frame = message['data'].decode()
+            await self.deliver(channel[len(prefix):], frame)
+
+_fanout = None
+
+def get_fanout():
+    global _fanout
+    if _fanout is None:
+        _fanout = LocalFanout(getattr(settings, 'CHAT_BROADCAST_REDIS_URL', None))
+    return _fanout
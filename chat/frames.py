@@ -0,0 +1,102 @@
+import struct
+import tempfile
+import uuid
+from typing import NamedTuple
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Binary voice frame
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# header (36 bytes, network order):
+#   chat_id (16 bytes uuid) | client_message_id (16 bytes uuid)
+#   codec (uint8) | seq (uint16) | flags (uint8)
+# و بعد از آن بایت‌های صوت همین تکه
+VOICE_HEADER = struct.Struct('!16s16sBHB')
+VOICE_FLAG_FINAL = 0x01
+
+VOICE_CODECS = {
+    0: 'audio/ogg',
+    1: 'audio/webm',
+    2: 'audio/mp4',
+    3: 'audio/mpeg',
+}
+
+class VoiceFrame(NamedTuple):
+    chat_id: uuid.UUID
+    client_message_id: uuid.UUID
+    codec: str
+    seq: int
+    is_final: bool
+    payload: bytes
+
+def parse_voice_frame(data):
+    if len(data) < VOICE_HEADER.size:
+        raise ValueError("frame is shorter than the voice header")
+    chat_id, client_message_id, codec, seq, flags = VOICE_HEADER.unpack_from(data)
+    if codec not in VOICE_CODECS:
+        raise ValueError(f"unknown voice codec {codec}")
+    return VoiceFrame(
+        chat_id=uuid.UUID(bytes=chat_id),
+        client_message_id=uuid.UUID(bytes=client_message_id),
+        codec=VOICE_CODECS[codec],
+        seq=seq,
+        is_final=bool(flags & VOICE_FLAG_FINAL),
+        payload=bytes(data[VOICE_HEADER.size:]),
+    )
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Voice Assembler
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class VoiceUpload:
+    def __init__(self, codec):
+        self.codec = codec
+        self.next_seq = 0
+        self.size = 0
+        # تا ۱ مگابایت در حافظه، بیشتر از آن روی دیسک
+        self.file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def close(self):
+        self.file.close()
+
+class VoiceAssembler:
+    """
+    سرهم کردن تکه‌های صوت هر پیام به ترتیب seq، بدون نگه داشتن کل فایل در حافظه
+    """
+    def __init__(self, max_bytes, max_uploads=4):
+        self.max_bytes = max_bytes
+        self.max_uploads = max_uploads
+        self.uploads = {}
+
+    def add(self, frame):
+        """
+        تکه را اضافه می‌کند؛ در تکه‌ی آخر VoiceUpload کامل برمی‌گردد.
+        ترتیب یا حجم نامعتبر ValueError می‌دهد و آپلود دور ریخته می‌شود.
+        """
+        upload = self.uploads.get(frame.client_message_id)
+        if upload is None:
+            if frame.seq != 0 or len(self.uploads) >= self.max_uploads:
+                raise ValueError("unexpected voice upload")
+            upload = self.uploads[frame.client_message_id] = VoiceUpload(frame.codec)
+
+        if frame.seq != upload.next_seq or upload.size + len(frame.payload) > self.max_bytes:
+            self.discard(frame.client_message_id)
+            raise ValueError("voice chunk out of order or too large")
+
+        upload.file.write(frame.payload)
+        upload.size += len(frame.payload)
+        upload.next_seq += 1
+
+        if not frame.is_final:
+            return None
+
+        del self.uploads[frame.client_message_id]
+        upload.file.seek(0)
+        return upload
+
+    def discard(self, client_message_id):
+        upload = self.uploads.pop(client_message_id, None)
+        if upload is not None:
+            upload.close()
+
+    def clear(self):
+        for client_message_id in list(self.uploads):
+            self.discard(client_message_id)
@@ -0,0 +1,203 @@
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import prefetch_related_objects
+from chat.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Cache keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# chat:history:<chat_id>      LIST  آخرین K + 1 پیام serialize شده (قدیمی به جدید)؛
+#                                   کمتر از K + 1 یعنی کل پیام‌های زنده‌ی چت
+# chat:history:ver:<chat_id>  INT   با هر append / invalidate زیاد می‌شود تا fill
+#                                   هم‌زمان یک لیست کهنه ننویسد
+def history_key(chat_id):
+    return f'chat:history:{chat_id}'
+
+def version_key(chat_id):
+    return f'chat:history:ver:{chat_id}'
+
+def history_size():
+    return getattr(settings, 'CHAT_HISTORY_CACHE_SIZE', 50)
+
+def history_ttl():
+    return getattr(settings, 'CHAT_HISTORY_CACHE_TTL', 10 * 60)
+
+def build_entry(message):
+    """آدرس فایل‌ها نسبی ذخیره می‌شود؛ MessageSerializer.absolute_urls در پاسخ کاملشان می‌کند"""
+    from chat.pagination import encode_cursor
+    from chat.serializers import MessageSerializer
+    return json.dumps({
+        'id': str(message.id),
+        'sent_at': message.sent_at.isoformat(),
+        'cursor': encode_cursor(message),
+        'data': MessageSerializer(message).data,
+    }, cls=DjangoJSONEncoder)
+
+def get_redis_client():
+    """اتصال خام Redis وقتی cache پیش‌فرض django-redis است؛ در غیر این صورت None"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# History Cache
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class HistoryCache:
+    """
+    صفحه‌ی اول تاریخچه‌ی هر چت (K + 1 پیام آخر تا has_older بدون کوئری معلوم باشد).
+    چت کوچک‌تر کامل cache می‌شود؛ append تا K + 1 پیام چیزی را بیرون نمی‌اندازد،
+    پس لیست کوتاه همیشه کل جدول زنده‌ی آن چت است.
+    با django-redis یک LIST در Redis است (RPUSHX + LTRIM برای write-through)؛
+    با LocMemCache همان لیست در cache همین پردازه با یک قفل محلی نگه داشته می‌شود.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    # -----------------------------------
+    # Read
+    # -----------------------------------
+    def get(self, chat_id):
+        client = get_redis_client()
+        if client is not None:
+            raw = client.lrange(cache.make_key(history_key(chat_id)), 0, -1)
+        else:
+            raw = cache.get(history_key(chat_id))
+        if not raw:
+            registry.increment('history_cache_miss')
+            return None
+        registry.increment('history_cache_hit')
+        entries = [json.loads(item) for item in raw]
+        # append های هم‌زمان ممکن است جابجا رسیده باشند
+        entries.sort(key=lambda entry: (entry['sent_at'], entry['id']))
+        return entries
+
+    def fill(self, chat_id, queryset):
+        """
+        ساخت لیست از دیتابیس (چت بدون پیام cache نمی‌شود)؛ اگر در این فاصله
+        پیامی اضافه/حذف شده باشد (version عوض شده) چیزی نوشته نمی‌شود
+        """
+        size = history_size() + 1
+        client = get_redis_client()
+        if client is None:
+            version = cache.get(version_key(chat_id), 0)
+            entries = self._load(queryset, size)
+            if entries:
+                with self.lock:
+                    if cache.get(version_key(chat_id), 0) == version:
+                        cache.set(history_key(chat_id), entries, history_ttl())
+            return self._decode(entries)
+
+        from redis.exceptions import WatchError
+        key = cache.make_key(history_key(chat_id))
+        with client.pipeline() as pipe:
+            pipe.watch(cache.make_key(version_key(chat_id)))
+            entries = self._load(queryset, size)
+            if entries:
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *entries)
+                pipe.expire(key, history_ttl())
+                try:
+                    pipe.execute()
+                except WatchError:
+                    pass
+        return self._decode(entries)
+
+    # -----------------------------------
+    # Write-through / invalidation
+    # -----------------------------------
+    def append(self, message):
+        """
+        فقط اگر لیست آن چت در cache باشد پیام جدید به انتها اضافه می‌شود (RPUSHX)؛
+        در غیر این صورت فقط version زیاد می‌شود و serialize انجام نمی‌شود
+        """
+        chat_id = message.chat_id
+        size = history_size() + 1
+        client = get_redis_client()
+        if client is None:
+            with self.lock:
+                self._bump_version(chat_id)
+                entries = cache.get(history_key(chat_id))
+                if entries:
+                    entries = [*entries, build_entry(message)][-size:]
+                    cache.set(history_key(chat_id), entries, history_ttl())
+            return
+
+        key = cache.make_key(history_key(chat_id))
+        if not client.exists(key):
+            client.incr(cache.make_key(version_key(chat_id)))
+            return
+        pipe = client.pipeline()
+        pipe.incr(cache.make_key(version_key(chat_id)))
+        pipe.rpushx(key, build_entry(message))
+        pipe.ltrim(key, -size, -1)
+        pipe.execute()
+
+    def invalidate(self, chat_id):
+        client = get_redis_client()
+        if client is None:
+            with self.lock:
+                self._bump_version(chat_id)
+                cache.delete(history_key(chat_id))
+            return
+        pipe = client.pipeline()
+        pipe.incr(cache.make_key(version_key(chat_id)))
+        pipe.delete(cache.make_key(history_key(chat_id)))
+        pipe.execute()
+
+    # -----------------------------------
+    # Helpers
+    # -----------------------------------
+    def _bump_version(self, chat_id):
+        cache.set(version_key(chat_id), cache.get(version_key(chat_id), 0) + 1, None)
+
+    @staticmethod
+    def _load(queryset, size):
+        messages = list(queryset.order_by('-sent_at', '-id')[:size])
+        return [build_entry(message) for message in reversed(messages)]
+
+    @staticmethod
+    def _decode(entries):
+        if not entries:
+            return None
+        return [json.loads(entry) for entry in entries]
+
+history_cache = HistoryCache()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Hooks (بعد از commit از Message / persistence صدا زده می‌شوند)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# خطای cache نباید ذخیره‌ی پیام را خراب کند؛ در بدترین حالت TTL لیست را تازه می‌کند
+def message_created(message):
+    try:
+        if message.reply_to_id:
+            # reply_count پیام ریشه که شاید در لیست باشد تغییر کرده است
+            history_cache.invalidate(message.chat_id)
+        else:
+            history_cache.append(message)
+    except Exception:
+        logger.exception("history cache append failed for chat %s", message.chat_id)
+
+def messages_created(messages, prefetch=False):
+    """مسیرهای bulk (write-behind، فوروارد گروهی)"""
+    if prefetch:
+        try:
+            prefetch_related_objects(messages, 'sender__profile_chat', 'voice', 'forward_from')
+        except Exception:
+            logger.exception("history cache prefetch failed")
+    for message in messages:
+        message_created(message)
+
+def message_changed(chat_id):
+    try:
+        history_cache.invalidate(chat_id)
+    except Exception:
+        logger.exception("history cache invalidation failed for chat %s", chat_id)
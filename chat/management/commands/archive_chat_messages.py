@@ -0,0 +1,101 @@
+import tempfile
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from chat.archive import (
+    archive_compression,
+    export_partition,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    previous_month,
+    partition_bounds,
+)
+from chat.models import Chat, ChatMembership, ChatUnreadCounter, MessageArchive, MessageArchiveBlock
+
+ARCHIVE_SUFFIX = {'gzip': 'jsonl.gz', 'zstd': 'jsonl.zst'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Move monthly chat_message partitions older than --keep-months into compressed "
+        "JSONL files (MessageArchive), then detach and drop them. The history API reads "
+        "archived months lazily when scrolling past the live table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=12, help='Months kept in the live table')
+        parser.add_argument('--compression', choices=sorted(ARCHIVE_SUFFIX), default=None,
+                            help='Defaults to zstd when zstandard is installed, otherwise gzip')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the partitions to archive')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError("--keep-months must be at least 1")
+
+        cutoff = month_start(timezone.now())
+        for _ in range(options['keep_months']):
+            cutoff = previous_month(cutoff)
+
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("chat_message is not partitioned; run partition_chat_messages first")
+            partitions = [
+                name for name in list_partitions(cursor)
+                if partition_bounds(name)[1] <= cutoff
+            ]
+
+        if not partitions:
+            self.stdout.write("Nothing to archive")
+            return
+
+        compression = options['compression'] or archive_compression()
+        for partition in partitions:
+            if options['dry_run']:
+                self.stdout.write(f"would archive {partition}")
+                continue
+            archive = self.archive_partition(partition, compression)
+            self.stdout.write(self.style.SUCCESS(f"archived {archive}"))
+
+    def archive_partition(self, partition, compression):
+        period_start, period_end = partition_bounds(partition)
+
+        # export بیرون از تراکنش؛ قفل chat_message فقط برای detach/drop گرفته می‌شود
+        with tempfile.TemporaryFile() as spool:
+            row_count, blocks = export_partition(partition, spool, compression)
+            spool.seek(0)
+
+            qn = connection.ops.quote_name
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE chat_message DETACH PARTITION {qn(partition)}")
+                cursor.execute(f"SELECT count(*) FROM {qn(partition)}")
+                if cursor.fetchone()[0] != row_count:
+                    raise CommandError(f"{partition} changed while exporting; run again")
+
+                # اشاره‌گرهای denormalize شده به پیام‌های آرشیو شده پاک می‌شوند
+                for model, column in (
+                    (Chat, 'last_message_id'),
+                    (ChatMembership, 'last_read_message_id'),
+                    (ChatUnreadCounter, 'last_message_id'),
+                ):
+                    table = qn(model._meta.db_table)
+                    cursor.execute(
+                        f"UPDATE {table} SET {column} = NULL WHERE {column} IN (SELECT id FROM {qn(partition)})"
+                    )
+
+                archive = MessageArchive(
+                    partition=partition,
+                    period_start=period_start,
+                    period_end=period_end,
+                    compression=compression,
+                    row_count=row_count,
+                )
+                archive.file.save(f"{partition}.{ARCHIVE_SUFFIX[compression]}", File(spool), save=False)
+                archive.save()
+                MessageArchiveBlock.objects.bulk_create(
+                    [MessageArchiveBlock(archive=archive, **block) for block in blocks],
+                    batch_size=5000,
+                )
+                cursor.execute(f"DROP TABLE {qn(partition)}")
+        return archive
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from chat.models import Message
+from chat.search import SEARCH_CONFIG, normalize_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill Message.search_vector for rows written before full-text search existed. "
+        "Walks the table by id range so each batch is one short UPDATE; safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of messages updated per UPDATE statement',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='rebuild_all',
+            help='Recompute every vector, not only the missing ones (e.g. after normalize_text changes)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        messages = Message.objects.order_by('pk')
+        if not options['rebuild_all']:
+            messages = messages.filter(search_vector__isnull=True)
+
+        updated = 0
+        last_pk = None
+        while True:
+            batch = messages if last_pk is None else messages.filter(pk__gt=last_pk)
+            rows = list(batch.values_list('pk', 'content')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            with transaction.atomic():
+                self.update_vectors(rows)
+            updated += len(rows)
+            self.stdout.write(f"{updated} messages updated")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled search vectors for {updated} messages"))
+
+    @staticmethod
+    def update_vectors(rows):
+        # نرمال‌سازی فارسی در پایتون است (chat.search.normalize_text)، پس متن آماده
+        # با VALUES فرستاده می‌شود و to_tsvector در همان UPDATE حساب می‌شود
+        qn = connection.ops.quote_name
+        pk_type = Message._meta.pk.db_type(connection)
+        values = ', '.join([f"(%s::{pk_type}, %s::text)"] * len(rows))
+        params = [value for pk, content in rows for value in (pk, normalize_text(content))]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {qn(Message._meta.db_table)} AS m "
+                f"SET search_vector = to_tsvector(%s::regconfig, v.content) "
+                f"FROM (VALUES {values}) AS v(id, content) WHERE m.id = v.id",
+                [SEARCH_CONFIG, *params],
+            )
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from chat.fanout import LocalFanout
+
+
+class CountingSocket:
+    """سوکت ساختگی که فقط تعداد frameهای دریافتی را می‌شمارد"""
+    def __init__(self, expected, done):
+        self.received = 0
+        self.expected = expected
+        self.done = done
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.received += 1
+        if self.received == self.expected:
+            self.done.release()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare plain channel-layer group_send against publish-once local fan-out "
+        "for chats with many subscribers. With --redis, channels_redis and Redis pub/sub "
+        "are used and Redis commands are counted from INFO stats."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', default='100,1000,10000', help='Comma separated subscriber counts')
+        parser.add_argument('--messages', type=int, default=50, help='Messages per run')
+        parser.add_argument('--redis', default=None, help='Redis URL; in-memory layer and in-process fan-out when omitted')
+
+    def handle(self, *args, **options):
+        counts = [int(value) for value in options['subscribers'].split(',') if value]
+        rows = async_to_sync(self.run)(counts, options['messages'], options['redis'])
+
+        self.stdout.write(f"{'mode':<12}{'subs':>8}{'msgs/sec':>12}{'deliveries/sec':>16}{'redis ops':>12}")
+        for mode, subscribers, rate, delivery_rate, ops in rows:
+            self.stdout.write(
+                f"{mode:<12}{subscribers:>8}{rate:>12.1f}{delivery_rate:>16.1f}{ops if ops is not None else 'n/a':>12}"
+            )
+
+    async def run(self, counts, message_count, redis_url):
+        client = None
+        if redis_url:
+            import redis.asyncio as redis
+            client = redis.from_url(redis_url)
+
+        rows = []
+        for subscribers in counts:
+            rows.append(await self.bench_group_send(subscribers, message_count, redis_url, client))
+            rows.append(await self.bench_fanout(subscribers, message_count, redis_url, client))
+        return rows
+
+    async def redis_ops(self, client):
+        if client is None:
+            return None
+        return (await client.info('stats'))['total_commands_processed']
+
+    async def bench_group_send(self, subscribers, message_count, redis_url, client):
+        if redis_url:
+            from channels_redis.core import RedisChannelLayer
+            layer = RedisChannelLayer(hosts=[redis_url], capacity=message_count + 10)
+        else:
+            layer = InMemoryChannelLayer(capacity=message_count + 10)
+
+        channels = [await layer.new_channel() for _ in range(subscribers)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+
+        frame = json.dumps({'content': 'x' * 100})
+        ops_before = await self.redis_ops(client)
+        started = time.perf_counter()
+        for _ in range(message_count):
+            await layer.group_send('bench', {'type': 'chat_message', 'message': frame})
+
+        async def drain(channel):
+            for _ in range(message_count):
+                await layer.receive(channel)
+
+        await asyncio.gather(*(drain(channel) for channel in channels))
+        elapsed = time.perf_counter() - started
+        ops_after = await self.redis_ops(client)
+
+        for channel in channels:
+            await layer.group_discard('bench', channel)
+        if hasattr(layer, 'flush'):
+            await layer.flush()
+
+        ops = None if ops_before is None else ops_after - ops_before
+        return ('group_send', subscribers, message_count / elapsed,
+                message_count * subscribers / elapsed, ops)
+
+    async def bench_fanout(self, subscribers, message_count, redis_url, client):
+        fanout = LocalFanout(redis_url)
+        done = asyncio.Semaphore(0)
+        sockets = [CountingSocket(message_count, done) for _ in range(subscribers)]
+        for socket in sockets:
+            await fanout.register('bench', socket)
+
+        frame = json.dumps({'content': 'x' * 100})
+        ops_before = await self.redis_ops(client)
+        started = time.perf_counter()
+        for _ in range(message_count):
+            await fanout.publish('bench', frame)
+        for _ in sockets:
+            await done.acquire()
+        elapsed = time.perf_counter() - started
+        ops_after = await self.redis_ops(client)
+
+        for socket in sockets:
+            await fanout.unregister('bench', socket)
+        if fanout._listener is not None:
+            fanout._listener.cancel()
+
+        ops = None if ops_before is None else ops_after - ops_before
+        return ('broadcast', subscribers, message_count / elapsed,
+                message_count * subscribers / elapsed, ops)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+IN_MEMORY_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {
+            'capacity': 100000,
+        },
+    },
+}
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive N concurrent ChatConsumer sockets against the in-memory channel layer "
+        "and report messages/sec and p50/p99 fan-out latency. "
+        "Messages are persisted to the configured database, so use a staging chat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', required=True, help='Chat id; its active members are used as socket users')
+        parser.add_argument('--sockets', type=int, default=50, help='Number of concurrent sockets')
+        parser.add_argument('--messages', type=int, default=200, help='Total messages sent across all sockets')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for fan-out to finish')
+
+    def handle(self, *args, **options):
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS):
+            report = async_to_sync(self.run)(
+                options['chat'],
+                options['sockets'],
+                options['messages'],
+                options['timeout'],
+            )
+
+        for key, value in report.items():
+            self.stdout.write(f"{key:>16}: {value}")
+
+    async def run(self, chat_id, socket_count, message_count, timeout):
+        users = await database_sync_to_async(list)(
+            User.objects.filter(
+                chat_member__chat_id=chat_id,
+                chat_member__is_active=True
+            )[:socket_count]
+        )
+        if not users:
+            raise CommandError("Chat has no active members to connect as")
+
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for index in range(socket_count):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{chat_id}/')
+            communicator.scope['user'] = users[index % len(users)]
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f"Socket {index} was rejected by ChatConsumer")
+            communicators.append(communicator)
+
+        latencies = []
+
+        async def read_all(communicator):
+            received = 0
+            while received < message_count:
+                frame = json.loads(await communicator.receive_from(timeout=timeout))
+                content = (frame.get('content') or '')
+                if not content.startswith('bench:'):
+                    continue
+                latencies.append(time.perf_counter() - float(content.split(':')[2]))
+                received += 1
+
+        async def send_share(index, communicator):
+            for number in range(index, message_count, len(communicators)):
+                await communicator.send_to(text_data=json.dumps({
+                    'message': f'bench:{number}:{time.perf_counter()}',
+                }))
+
+        readers = [asyncio.ensure_future(read_all(c)) for c in communicators]
+        started = time.perf_counter()
+        await asyncio.gather(*(send_share(i, c) for i, c in enumerate(communicators)))
+        send_elapsed = time.perf_counter() - started
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*readers), timeout)
+        except asyncio.TimeoutError:
+            for reader in readers:
+                reader.cancel()
+        elapsed = time.perf_counter() - started
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        return {
+            'sockets': socket_count,
+            'messages': message_count,
+            'deliveries': f"{len(latencies)}/{message_count * socket_count}",
+            'send msgs/sec': f"{message_count / send_elapsed:.1f}",
+            'deliveries/sec': f"{len(latencies) / elapsed:.1f}",
+            'p50 fan-out ms': f"{percentile(latencies, 0.50) * 1000:.2f}",
+            'p99 fan-out ms': f"{percentile(latencies, 0.99) * 1000:.2f}",
+        }
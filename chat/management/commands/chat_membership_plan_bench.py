@@ -0,0 +1,99 @@
+import math
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from chat.models import Chat, ChatMembership
+from chat.types import CHAT_TYPE_CHOICES
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare query plans and timings of the chat list query: the old JOIN + DISTINCT "
+        "against EXISTS on member_active_user_chat_idx. With --memberships, synthetic chats "
+        "and memberships for existing users are created inside a transaction that is rolled "
+        "back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--memberships', type=int, default=0, help='Synthetic memberships to add (e.g. 1000000)')
+        parser.add_argument('--user', default=None, help='User whose chat list is measured (default: first user)')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--batch-size', type=int, default=10000, help='bulk_create batch size for seeding')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("the plan comparison needs PostgreSQL")
+        try:
+            with transaction.atomic():
+                if options['memberships']:
+                    self.seed(options['memberships'], options['batch_size'])
+                user = self.bench_user(options['user'])
+                self.compare(user, options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench_user(self, user_id):
+        user = User.objects.filter(pk=user_id).first() if user_id else User.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError("no user to benchmark")
+        return user
+
+    def seed(self, total, batch_size):
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        if not user_ids:
+            raise CommandError("seeding needs at least one existing user")
+
+        chat_count = math.ceil(total / len(user_ids))
+        self.stdout.write(f"seeding {chat_count} chats and {total} memberships for {len(user_ids)} users")
+        chats = Chat.objects.bulk_create(
+            [Chat(name=f"bench {number}", chat_type=CHAT_TYPE_CHOICES.group) for number in range(chat_count)],
+            batch_size=batch_size,
+        )
+
+        batch = []
+        created = 0
+        for chat in chats:
+            for user_id in user_ids:
+                if created >= total:
+                    break
+                # حدود یک دهم عضویت‌ها غیرفعال تا partial index معنی داشته باشد
+                batch.append(ChatMembership(chat=chat, user_id=user_id, is_active=created % 10 != 0))
+                created += 1
+                if len(batch) >= batch_size:
+                    ChatMembership.objects.bulk_create(batch)
+                    batch = []
+        if batch:
+            ChatMembership.objects.bulk_create(batch)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ChatMembership._meta.db_table}")
+            cursor.execute(f"ANALYZE {Chat._meta.db_table}")
+
+    def compare(self, user, runs):
+        old = Chat.objects.filter(
+            membership_chat__user=user,
+            membership_chat__is_active=True
+        ).distinct()
+        new = Chat.objects.filter(Exists(ChatMembership.objects.filter(
+            chat=OuterRef('pk'),
+            user=user,
+            is_active=True
+        )))
+
+        for label, queryset in (('join + distinct', old), ('exists', new)):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {label}"))
+            self.stdout.write(queryset.explain(analyze=True, buffers=True))
+            started = time.perf_counter()
+            for _ in range(runs):
+                list(queryset.values_list('pk', flat=True))
+            elapsed = (time.perf_counter() - started) / runs
+            self.stdout.write(f"avg {elapsed * 1000:.2f} ms over {runs} runs")
@@ -0,0 +1,51 @@
+import json
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat.models import Message
+from chat.serializers import MessageRealtimeSerializer, MessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark realtime message encoding: DRF MessageSerializer re-encoded per "
+        "recipient (old path) against MessageRealtimeSerializer encoded once per message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Messages to encode')
+        parser.add_argument('--recipients', type=int, default=50, help='Recipients per message (fan-out)')
+
+    def handle(self, *args, **options):
+        message_count = options['messages']
+        recipients = options['recipients']
+        # پیام‌های ساخته شده در حافظه؛ بدون دیتابیس
+        messages = [
+            Message(
+                id=uuid.uuid4(),
+                chat_id=uuid.uuid4(),
+                sender_id=None,
+                content=f"پیام آزمایشی شماره {number}",
+                sent_at=timezone.now(),
+            )
+            for number in range(message_count)
+        ]
+
+        started = time.perf_counter()
+        for message in messages:
+            data = MessageSerializer(message).data
+            for _ in range(recipients):
+                json.dumps(data, default=str)
+        drf_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for message in messages:
+            # همه‌ی گیرنده‌ها همین رشته را بدون encode دوباره می‌گیرند
+            MessageRealtimeSerializer.encode(MessageRealtimeSerializer.to_dict(message))
+        realtime_elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"messages={message_count} recipients={recipients}")
+        self.stdout.write(f"drf + per-recipient json : {message_count / drf_elapsed:>10.1f} msgs/sec")
+        self.stdout.write(f"realtime encode-once     : {message_count / realtime_elapsed:>10.1f} msgs/sec")
+        self.stdout.write(f"speedup                  : {drf_elapsed / realtime_elapsed:>10.1f}x")
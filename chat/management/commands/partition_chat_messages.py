@@ -0,0 +1,110 @@
+from datetime import timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from chat.archive import (
+    DEFAULT_PARTITION,
+    create_month_partition,
+    is_partitioned,
+    month_start,
+    next_month,
+)
+
+LEGACY_TABLE = 'chat_message_legacy'
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert chat_message into a table range-partitioned by month on sent_at, or, "
+        "when it already is, create the partitions for the coming months. The conversion "
+        "copies every row under an exclusive lock, so run it in a maintenance window. "
+        "The primary key becomes (id, sent_at); foreign keys that reference chat_message "
+        "(reply_to, forward_from, thread_root, last_message, read cursors) are dropped because Postgres "
+        "cannot reference a partitioned table by id alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3, help='Future monthly partitions to keep ready')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("partitioning chat_message needs PostgreSQL")
+
+        this_month = month_start(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            if is_partitioned(cursor):
+                created = self.create_partitions(cursor, this_month, this_month, options['months_ahead'])
+                self.stdout.write(self.style.SUCCESS(f"chat_message already partitioned; ensured {created} partitions"))
+                return
+            created, copied, dropped = self.convert(cursor, this_month, options['months_ahead'])
+
+        for table, name in dropped:
+            self.stdout.write(f"dropped foreign key {name} on {table}")
+        self.stdout.write(self.style.SUCCESS(f"Partitioned chat_message: {created} partitions, {copied} rows copied"))
+
+    def create_partitions(self, cursor, first_month, this_month, months_ahead):
+        last_month = this_month
+        for _ in range(months_ahead):
+            last_month = next_month(last_month)
+
+        created = 0
+        period = first_month
+        while period <= last_month:
+            create_month_partition(cursor, period)
+            period = next_month(period)
+            created += 1
+        return created
+
+    def convert(self, cursor, this_month, months_ahead):
+        cursor.execute("LOCK TABLE chat_message IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("SELECT min(sent_at) FROM chat_message")
+        oldest = cursor.fetchone()[0]
+        first_month = month_start(oldest.astimezone(dt_timezone.utc)) if oldest else this_month
+
+        # تعریف ایندکس‌ها قبل از rename گرفته می‌شود تا روی جدول جدید ساخته شوند
+        cursor.execute(
+            """
+            SELECT indexdef FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = 'chat_message'
+              AND indexname NOT IN (
+                  SELECT conname FROM pg_constraint
+                  WHERE conrelid = 'chat_message'::regclass AND contype IN ('p', 'u')
+              )
+            """
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = 'chat_message'::regclass AND contype = 'f' AND confrelid <> conrelid
+            """
+        )
+        outgoing_fks = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conrelid::regclass::text, conname FROM pg_constraint
+            WHERE confrelid = 'chat_message'::regclass AND contype = 'f'
+            """
+        )
+        dropped = cursor.fetchall()
+
+        cursor.execute(f"ALTER TABLE chat_message RENAME TO {LEGACY_TABLE}")
+        cursor.execute(
+            f"CREATE TABLE chat_message (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (sent_at)"
+        )
+        # کلید partition باید جزو primary key باشد
+        cursor.execute("ALTER TABLE chat_message ADD PRIMARY KEY (id, sent_at)")
+        created = self.create_partitions(cursor, first_month, this_month, months_ahead)
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF chat_message DEFAULT")
+
+        cursor.execute(f"INSERT INTO chat_message SELECT * FROM {LEGACY_TABLE}")
+        copied = cursor.rowcount
+        # CASCADE فقط constraintهای FK جداول دیگر را حذف می‌کند، نه داده‌ها را
+        cursor.execute(f"DROP TABLE {LEGACY_TABLE} CASCADE")
+
+        for index_def in index_defs:
+            cursor.execute(index_def)
+        for name, definition in outgoing_fks:
+            cursor.execute(f"ALTER TABLE chat_message ADD CONSTRAINT {connection.ops.quote_name(name)} {definition}")
+        return created, copied, dropped
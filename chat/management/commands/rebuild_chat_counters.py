@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from chat.models import Chat, ChatMembership, Message
+
+
+class Command(BaseCommand):
+    help = "Rebuild denormalised chat counters (member_count, message_count, last_message, last_activity_at, last_seq)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chat',
+            action='append',
+            dest='chat_ids',
+            help='Only rebuild the given chat id (can be repeated)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of chats updated per UPDATE statement',
+        )
+
+    def handle(self, *args, **options):
+        chats = Chat.objects.order_by('pk')
+        if options['chat_ids']:
+            chats = chats.filter(pk__in=options['chat_ids'])
+
+        member_count = ChatMembership.objects.filter(
+            chat=OuterRef('pk'),
+            is_active=True
+        ).values('chat').annotate(total=Count('*')).values('total')
+        message_count = Message.objects.filter(
+            chat=OuterRef('pk')
+        ).values('chat').annotate(total=Count('*')).values('total')
+        latest = Message.objects.latest_for_chat(OuterRef('pk'))
+        last_seq = Message.objects.filter(
+            chat=OuterRef('pk'),
+            seq__isnull=False
+        ).order_by('-seq').values('seq')[:1]
+
+        batch_size = options['batch_size']
+        chat_ids = list(chats.values_list('pk', flat=True))
+        for start in range(0, len(chat_ids), batch_size):
+            Chat.objects.filter(pk__in=chat_ids[start:start + batch_size]).update(
+                member_count=Coalesce(Subquery(member_count), 0),
+                message_count=Coalesce(Subquery(message_count), 0),
+                last_message=Subquery(latest.values('id')[:1]),
+                last_activity_at=Subquery(latest.values('sent_at')[:1]),
+                last_seq=Coalesce(Subquery(last_seq), 0),
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {len(chat_ids)} chats"))
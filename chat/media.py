@@ -0,0 +1,76 @@
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def voice_max_bytes():
+    return getattr(settings, 'CHAT_VOICE_MAX_BYTES', 10 * 1024 * 1024)
+
+def parse_range(header, size):
+    """
+    فقط یک بازه پشتیبانی می‌شود (bytes=start-end یا bytes=-suffix)
+    None یعنی بازه نامعتبر است
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        length = min(int(end), size)
+        # bytes=-0 (یا فایل خالی) هیچ بایتی را پوشش نمی‌دهد
+        if length == 0:
+            return None
+        return size - length, size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+def iter_file_range(file_obj, start, length, chunk_size=64 * 1024):
+    try:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+def ranged_file_response(request, field_file, size, content_type):
+    """
+    پخش فایل از storage با پشتیبانی از HTTP Range (206 Partial Content)
+    """
+    range_header = request.META.get('HTTP_RANGE')
+    if not range_header:
+        response = FileResponse(field_file.open('rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Length'] = str(size)
+        return response
+
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        iter_file_range(field_file.open('rb'), start, length),
+        status=206,
+        content_type=content_type,
+    )
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from chat.models import ChatMembership
+from chat.utils import admin_count_cache_key
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Admin count cache
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# chat:admins:<chat_id>  INT  تعداد ادمین‌های فعال؛ با notify_membership_change(s) پاک می‌شود
+def admin_count(chat_id):
+    key = admin_count_cache_key(chat_id)
+    count = cache.get(key)
+    if count is None:
+        count = ChatMembership.objects.filter(
+            chat_id=chat_id,
+            is_active=True,
+            is_admin=True
+        ).count()
+        cache.set(key, count, getattr(settings, 'CHAT_ADMIN_COUNT_CACHE_TTL', 300))
+    return count
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Membership Snapshot
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MembershipSnapshot:
+    """
+    عضویت فعال کاربر در یک چت (همراه خود چت) که یک بار برای هر درخواست یا
+    سوکت خوانده می‌شود؛ همه‌ی بررسی‌های نقش از همین snapshot جواب داده می‌شوند
+    """
+    def __init__(self, membership):
+        self.membership = membership
+        self.chat = membership.chat
+
+    @classmethod
+    def load(cls, chat_id, user):
+        """یک کوئری (member JOIN chat)؛ None یعنی کاربر عضو فعال این چت نیست"""
+        if not user.is_authenticated:
+            return None
+        try:
+            membership = ChatMembership.objects.select_related('chat').filter(
+                chat_id=chat_id,
+                user=user,
+                is_active=True,
+                chat__is_active=True
+            ).first()
+        except (ValueError, ValidationError):
+            return None
+        return cls(membership) if membership else None
+
+    # -----------------------------------
+    # Roles
+    # -----------------------------------
+    @property
+    def chat_id(self):
+        return self.chat.id
+
+    @property
+    def user_id(self):
+        return self.membership.user_id
+
+    @property
+    def is_admin(self):
+        return self.membership.is_admin
+
+    # -----------------------------------
+    # Permissions
+    # -----------------------------------
+    def can_message(self):
+        return True
+
+    def can_manage_members(self):
+        return self.is_admin
+
+    def can_remove_admin(self):
+        """ادمین آخر نمی‌تواند خودش را حذف یا تنزل دهد"""
+        return not self.is_admin or admin_count(self.chat_id) > 1
@@ -0,0 +1,248 @@
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger('chat.metrics')
+
+# مرزهای هیستوگرام: زمان‌ها به ثانیه، تعداد کوئری به عدد
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# نوع رویدادهایی که consumerها پردازش می‌کنند؛ بقیه 'unknown' تا کلاینت نتواند
+# با type دلخواه تعداد برچسب‌ها (و حافظه‌ی registry) را بی‌نهایت زیاد کند
+WS_EVENT_TYPES = frozenset({'message', 'read', 'typing', 'presence', 'resume', 'voice_frame'})
+
+_current = contextvars.ContextVar('chat_metrics_sample', default=None)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Registry
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def escape_label(value):
+    """escape مقدار برچسب طبق فرمت متنی Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        if labels not in self.series:
+            self.series[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, total = self.series[labels]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        total[0] += value
+        total[1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, (value_sum, value_count)) in sorted(self.series.items()):
+            label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {value_sum}")
+            lines.append(f"{self.name}_count{{{label_text}}} {value_count}")
+        return '\n'.join(lines)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def render(self):
+        return '\n'.join([
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ])
+
+
+class MetricsRegistry:
+    """
+    هیستوگرام‌های درون‌پردازه‌ای هر worker؛ Prometheus هر worker را جدا scrape می‌کند
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'latency': Histogram('chat_request_latency_seconds', 'Total handling time', LATENCY_BUCKETS),
+            'queries': Histogram('chat_db_queries', 'Database queries per request/event', QUERY_BUCKETS),
+            'db': Histogram('chat_db_seconds', 'Time spent in database queries', LATENCY_BUCKETS),
+            'serialize': Histogram('chat_serialize_seconds', 'Time spent encoding responses/frames', LATENCY_BUCKETS),
+            'send': Histogram('chat_channel_send_seconds', 'Time spent in channel-layer sends', LATENCY_BUCKETS),
+        }
+        self.counters = {
+            'history_cache_hit': Counter('chat_history_cache_hits_total', 'First history pages served from cache'),
+            'history_cache_miss': Counter('chat_history_cache_misses_total', 'First history pages rebuilt from the database'),
+        }
+
+    def increment(self, name, amount=1):
+        """شمارنده‌ها همیشه (بدون نمونه‌برداری) شمرده می‌شوند"""
+        with self.lock:
+            self.counters[name].value += amount
+
+    def record(self, sample):
+        labels = (('kind', sample.kind), ('endpoint', sample.endpoint))
+        with self.lock:
+            self.histograms['latency'].observe(labels, sample.latency)
+            self.histograms['queries'].observe(labels, sample.queries)
+            self.histograms['db'].observe(labels, sample.timings['db'])
+            self.histograms['serialize'].observe(labels, sample.timings['serialize'])
+            self.histograms['send'].observe(labels, sample.timings['send'])
+
+    def render(self):
+        with self.lock:
+            metrics = [*self.histograms.values(), *self.counters.values()]
+            return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+registry = MetricsRegistry()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Samples
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Sample:
+    def __init__(self, kind, endpoint):
+        self.kind = kind
+        self.endpoint = endpoint
+        self.queries = 0
+        self.latency = 0.0
+        self.timings = {'db': 0.0, 'serialize': 0.0, 'send': 0.0}
+
+
+def is_sampled():
+    rate = getattr(settings, 'CHAT_METRICS_SAMPLE_RATE', 0.0)
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+@contextmanager
+def observe(kind, endpoint):
+    """
+    اندازه‌گیری یک درخواست HTTP یا رویداد WebSocket. کوئری‌ها (حتی در
+    thread های database_sync_to_async که context را کپی می‌کنند) به همین sample اضافه می‌شوند
+    """
+    sample = Sample(kind, endpoint)
+    token = _current.set(sample)
+    started = time.perf_counter()
+    try:
+        yield sample
+    finally:
+        sample.latency = time.perf_counter() - started
+        _current.reset(token)
+        registry.record(sample)
+        logger.info('chat.sample', extra={
+            'kind': sample.kind,
+            'endpoint': sample.endpoint,
+            'latency_ms': round(sample.latency * 1000, 3),
+            'db_queries': sample.queries,
+            'db_ms': round(sample.timings['db'] * 1000, 3),
+            'serialize_ms': round(sample.timings['serialize'] * 1000, 3),
+            'send_ms': round(sample.timings['send'] * 1000, 3),
+        })
+
+@contextmanager
+def timed(section):
+    """زمان یک بخش (serialize / send) در sample جاری؛ بدون sample هزینه‌ای ندارد"""
+    sample = _current.get()
+    if sample is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.timings[section] += time.perf_counter() - started
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper روی همه‌ی اتصال‌ها (از طریق signal connection_created)"""
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.timings['db'] += time.perf_counter() - started
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# HTTP
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class InstrumentationMiddleware:
+    """
+    نمونه‌برداری (CHAT_METRICS_SAMPLE_RATE) از درخواست‌ها؛ برچسب endpoint
+    نام route است تا شناسه‌ها cardinality را زیاد نکنند
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_sampled():
+            return self.get_response(request)
+        with observe('http', request.method) as sample:
+            response = self.get_response(request)
+            match = getattr(request, 'resolver_match', None)
+            sample.endpoint = f"{request.method} {match.view_name if match else 'unmatched'}"
+        return response
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def metrics_view(request):
+    """خروجی متنی Prometheus؛ با CHAT_METRICS_TOKEN (Bearer) یا کاربر staff"""
+    token = getattr(settings, 'CHAT_METRICS_TOKEN', '')
+    authorized = (
+        (token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')) or
+        (request.user.is_authenticated and request.user.is_staff)
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# WebSocket
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def event_type(text_data, bytes_data):
+    if bytes_data is not None:
+        return 'voice_frame'
+    try:
+        value = json.loads(text_data).get('type', 'message')
+    except (ValueError, AttributeError):
+        return 'invalid'
+    return value if isinstance(value, str) and value in WS_EVENT_TYPES else 'unknown'
+
+def instrument_receive(receive):
+    """دکوراتور receive در consumerها؛ برچسب: <Consumer>.<type>"""
+    @functools.wraps(receive)
+    async def wrapper(self, text_data=None, bytes_data=None):
+        if not is_sampled():
+            return await receive(self, text_data=text_data, bytes_data=bytes_data)
+        endpoint = f"{type(self).__name__}.{event_type(text_data, bytes_data)}"
+        with observe('ws', endpoint):
+            return await receive(self, text_data=text_data, bytes_data=bytes_data)
+    return wrapper
@@ -1,10 +1,15 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import PermissionDenied
+from django.db import connection, models, transaction
+from django.utils import timezone
 
 import jdatetime
 from authentication.models import GenericModel
-from notifications.models import Notifs
-from django.contrib.contenttypes.models import ContentType
+from chat.search import search_vector_for
+from chat.types import CHAT_TYPE_CHOICES
+from chat.utils import notify_membership_change, notify_members_change
 
 User = get_user_model()
 
@@ -72,6 +77,33 @@ class Chat(GenericModel):
         choices=CHAT_TYPE_CHOICES, 
         default='private'
     )
+    # شمارنده‌های denormalize شده؛ با F() به‌روز و با rebuild_chat_counters بازسازی می‌شوند
+    member_count = models.PositiveIntegerField(
+        'member_count',
+        default=0
+        )
+    message_count = models.PositiveBigIntegerField(
+        'message_count',
+        default=0
+        )
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='last_message',
+        blank=True,
+        null=True
+    )
+    last_activity_at = models.DateTimeField(
+        'last_activity_at',
+        blank=True,
+        null=True
+        )
+    # آخرین شماره‌ی ترتیب (Message.seq) داده شده در این چت
+    last_seq = models.PositiveBigIntegerField(
+        'last_seq',
+        default=0
+        )
     
     class Meta:
         indexes = [
@@ -89,23 +121,103 @@ class Chat(GenericModel):
     def active_memberships(self):
         return self.membership_chat.filter(is_active=True)
 
-    @property
-    def member_count(self):
-        return self.active_memberships.count()
-
     @property
     def is_private(self):
         return self.member_count <= 2
 
+    # -----------------------------------
+    # Counters
+    # -----------------------------------
+    @classmethod
+    def allocate_seq(cls, chat_id, count=1):
+        """
+        رزرو count شماره‌ی پشت سر هم؛ آخرین شماره برگردانده می‌شود
+        (بازه: last - count + 1 تا last)
+        """
+        return cls.allocate_seqs({chat_id: count}).get(str(chat_id))
+
+    @classmethod
+    def allocate_seqs(cls, counts):
+        """
+        نسخه‌ی چند چتی allocate_seq با یک UPDATE ... FROM (VALUES ...) RETURNING؛
+        counts: {chat_id: count} و خروجی {str(chat_id): last_seq}
+        """
+        if not counts:
+            return {}
+        qn = connection.ops.quote_name
+        pk_type = cls._meta.pk.db_type(connection)
+        values = ', '.join([f"(%s::{pk_type}, %s::bigint)"] * len(counts))
+        params = [value for chat_id, count in counts.items() for value in (chat_id, count)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {qn(cls._meta.db_table)} AS c SET last_seq = c.last_seq + v.count "
+                f"FROM (VALUES {values}) AS v(id, count) WHERE c.id = v.id "
+                f"RETURNING c.id, c.last_seq",
+                params,
+            )
+            return {str(chat_id): last_seq for chat_id, last_seq in cursor.fetchall()}
+
+    @classmethod
+    def change_member_count(cls, chat_id, delta):
+        cls.objects.filter(pk=chat_id).update(
+            member_count=models.F('member_count') + delta
+        )
+
+    @classmethod
+    def record_messages(cls, chat_id, count, last_message):
+        """
+        افزایش message_count و جابجایی last_message در یک UPDATE؛
+        پیام قدیمی‌تر (نوشته شده با تاخیر) last_message را عقب نمی‌برد
+        """
+        cls.record_message_batches([(chat_id, count, last_message, last_message.seq)])
+
+    @classmethod
+    def record_message_batches(cls, batches):
+        """
+        record_messages برای چند چت با یک UPDATE ... FROM (VALUES ...)؛
+        batches: [(chat_id, count, last_message, last_seq)] با یک ردیف برای هر چت.
+        last_seq فقط جلو می‌رود تا وقتی seq از Redis گرفته می‌شود (chat.sequence)
+        شمارنده‌ی از دست رفته از همین مقدار ادامه پیدا کند
+        """
+        if not batches:
+            return
+        qn = connection.ops.quote_name
+        pk_type = cls._meta.pk.db_type(connection)
+        message_pk_type = Message._meta.pk.db_type(connection)
+        values = ', '.join(
+            [f"(%s::{pk_type}, %s::bigint, %s::{message_pk_type}, %s::timestamptz, %s::bigint)"] * len(batches)
+        )
+        params = [
+            value
+            for chat_id, count, last_message, last_seq in batches
+            for value in (chat_id, count, last_message.pk, last_message.sent_at, last_seq)
+        ]
+        is_newer = "c.last_activity_at IS NULL OR c.last_activity_at <= v.sent_at"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {qn(cls._meta.db_table)} AS c SET "
+                f"message_count = c.message_count + v.count, "
+                f"last_message_id = CASE WHEN {is_newer} THEN v.message_id ELSE c.last_message_id END, "
+                f"last_activity_at = CASE WHEN {is_newer} THEN v.sent_at ELSE c.last_activity_at END, "
+                f"last_seq = GREATEST(c.last_seq, COALESCE(v.last_seq, 0)) "
+                f"FROM (VALUES {values}) AS v(id, count, message_id, sent_at, last_seq) WHERE c.id = v.id",
+                params,
+            )
+
     # -----------------------------------
     # Membership Management
     # -----------------------------------
+    def _membership_changed(self, user):
+        """بعد از commit، کش عضویت سوکت‌های باز این کاربر باطل می‌شود"""
+        chat_id, user_id = self.id, user.pk
+        transaction.on_commit(lambda: notify_membership_change(chat_id, user_id))
+
     def create_creator_membership(self):
         """ایجاد ممبر اولیه (ادمین)"""
         if not self.creator:
             return
 
-        ChatMembership.objects.get_or_create(
+        _, created = ChatMembership.objects.get_or_create(
             chat=self,
             user=self.creator,
             defaults={
@@ -113,6 +225,8 @@ class Chat(GenericModel):
                 'is_active': True
             }
         )
+        if created:
+            Chat.change_member_count(self.id, 1)
 
     def add_member(self, user, added_by=None):
         """
@@ -127,28 +241,22 @@ class Chat(GenericModel):
             }
         )
 
-        if not created and not membership.is_active:
+        if created:
+            Chat.change_member_count(self.id, 1)
+        elif not membership.is_active:
             membership.is_active = True
             membership.save(update_fields=['is_active'])
+            Chat.change_member_count(self.id, 1)
 
-        if added_by:
-                Notifs.objects.create(
-                    user=user,
-                    title="دعوت به چت",
-                    notif_type="chat",
-                    description=f"{added_by.full_name} شما را به چت '{self.name}' دعوت کرد",
+        self._membership_changed(user)
 
-                    content_type=ContentType.objects.get_for_model(Chat),
-                    object_id=self.id,
-                )
-
-        for member in self.active_memberships.exclude(user=user):
-            Notifs.objects.create(
-                user=member.user,
-                title="عضو جدید",
-                type="chat_member_added",
-                description=f"{user.full_name or user.mobile} به چت '{self.name}' اضافه شد"
-            )
+        # نوتیف‌ها در worker و به صورت bulk ساخته می‌شوند
+        from chat.tasks import notify_member_added
+        chat_id, user_id = self.id, user.pk
+        added_by_id = added_by.pk if added_by else None
+        transaction.on_commit(
+            lambda: notify_member_added.delay(chat_id, user_id, added_by_id)
+        )
 
         return True
 
@@ -163,26 +271,102 @@ class Chat(GenericModel):
 
         membership.is_active = False
         membership.save(update_fields=['is_active'])
+        Chat.change_member_count(self.id, -1)
+        self._membership_changed(user)
 
-        Notifs.objects.create(
-            user=user,
-            title="حذف از چت",
-            type="chat_removed",
-            description=f"شما از چت '{self.name}' حذف شدید"
+        from chat.tasks import notify_member_removed
+        chat_id, user_id = self.id, user.pk
+        transaction.on_commit(
+            lambda: notify_member_removed.delay(chat_id, user_id)
         )
 
         return True
 
+    def add_members(self, user_ids, added_by=None):
+        """
+        نسخه‌ی گروهی add_member: یک upsert (bulk_create با update_conflicts)،
+        یک رویداد membership_changed و یک نوتیف خلاصه برای اعضای قبلی.
+        تعداد کاربرهایی که واقعا اضافه شدند برگردانده می‌شود.
+        """
+        # قفل ردیف چت تا دو عملیات گروهی هم‌زمان member_count را دوبار حساب نکنند
+        Chat.objects.select_for_update().filter(pk=self.pk).values('pk').first()
+
+        active = set(self.active_memberships.filter(
+            user_id__in=user_ids
+        ).values_list('user_id', flat=True))
+        added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in active]
+        if not added:
+            return 0
+
+        ChatMembership.objects.bulk_create(
+            [ChatMembership(chat=self, user_id=user_id, is_admin=False, is_active=True) for user_id in added],
+            update_conflicts=True,
+            unique_fields=['chat', 'user'],
+            update_fields=['is_active'],
+        )
+        Chat.change_member_count(self.id, len(added))
+
+        from chat.tasks import notify_members_added
+        chat_id = self.id
+        added_by_id = added_by.pk if added_by else None
+        transaction.on_commit(lambda: notify_members_change(chat_id, added))
+        transaction.on_commit(
+            lambda: notify_members_added.delay(chat_id, [str(user_id) for user_id in added], added_by_id)
+        )
+        return len(added)
+
+    def remove_members(self, user_ids, keep_admin=False):
+        """
+        نسخه‌ی گروهی remove_member؛ تعداد عضویت‌های غیرفعال شده برگردانده می‌شود.
+        با keep_admin حذفی که چت را بدون ادمین فعال بگذارد PermissionDenied می‌دهد؛
+        شمارش ادمین‌ها بعد از قفل ردیف چت است تا دو حذف هم‌زمان هر دو رد نشوند
+        """
+        Chat.objects.select_for_update().filter(pk=self.pk).values('pk').first()
+
+        memberships = self.active_memberships.filter(user_id__in=user_ids)
+        removed = list(memberships.values_list('user_id', flat=True))
+        if not removed:
+            return 0
+
+        if keep_admin:
+            admins = self.active_memberships.filter(is_admin=True).aggregate(
+                total=models.Count('pk'),
+                removed=models.Count('pk', filter=models.Q(user_id__in=removed)),
+            )
+            if admins['total'] and admins['removed'] == admins['total']:
+                raise PermissionDenied("آخرین ادمین نمی‌تواند حذف شود")
+
+        memberships.update(is_active=False)
+        Chat.change_member_count(self.id, -len(removed))
+
+        from chat.tasks import notify_members_removed
+        chat_id = self.id
+        transaction.on_commit(lambda: notify_members_change(chat_id, removed))
+        transaction.on_commit(
+            lambda: notify_members_removed.delay(chat_id, [str(user_id) for user_id in removed])
+        )
+        return len(removed)
+
     def can_remove_admin(self, user):
-        admins = self.active_memberships.filter(is_admin=True)
-        return not (admins.count() == 1 and admins.first().user == user)
+        """یک کوئری: آیا user تنها ادمین فعال چت است؟"""
+        admins = self.active_memberships.filter(is_admin=True).aggregate(
+            total=models.Count('pk'),
+            target=models.Count('pk', filter=models.Q(user=user)),
+        )
+        return not (admins['total'] == 1 and admins['target'] == 1)
     
     def promote_to_admin(self, user):
         self.active_memberships.filter(user=user).update(is_admin=True)
+        self._membership_changed(user)
         
     def demote_admin(self, user):
-        if self.can_remove_admin(user):
-            self.active_memberships.filter(user=user).update(is_admin=False)
+        # شرط «ادمین دیگری هست» داخل همان UPDATE؛ بدون کوئری جدا
+        other_admins = self.active_memberships.filter(is_admin=True).exclude(user=user)
+        demoted = self.active_memberships.filter(user=user).filter(
+            models.Exists(other_admins)
+        ).update(is_admin=False)
+        if demoted:
+            self._membership_changed(user)
             
     # -----------------------------------
     # Permissions
@@ -234,19 +418,137 @@ class ChatMembership(GenericModel):
         'joined_at',
         auto_now_add=True
         )
+    # cursor خواندن: آخرین پیامی که کاربر در این چت دیده است
+    last_read_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name='last_read_message',
+        blank=True,
+        null=True
+    )
+    last_read_at = models.DateTimeField(
+        'last_read_at',
+        blank=True,
+        null=True
+        )
 
     class Meta:
         unique_together = ('chat', 'user')
+        indexes = [
+            # چت‌های فعال یک کاربر (EXISTS در ChatViewSet، inbox، UserConsumer)
+            models.Index(
+                fields=['user', 'chat'],
+                condition=models.Q(is_active=True),
+                name='member_active_user_chat_idx'
+            ),
+        ]
         verbose_name = "05-member"
         verbose_name_plural = "05-members"
         db_table = 'member'
+
+    @classmethod
+    def advance_read_cursor(cls, chat_id, user_id, message_id):
+        """
+        جلو بردن cursor خواندن (هیچ‌وقت عقب نمی‌رود) و بازنشانی شمارنده‌ی خوانده‌نشده
+        """
+        message = Message.objects.filter(
+            id=message_id,
+            chat_id=chat_id
+        ).only('id', 'sent_at').first()
+        if message is None:
+            return False
+
+        advanced = cls.objects.filter(
+            models.Q(last_read_at__isnull=True) | models.Q(last_read_at__lt=message.sent_at),
+            chat_id=chat_id,
+            user_id=user_id,
+            is_active=True,
+        ).update(
+            last_read_message=message,
+            last_read_at=message.sent_at,
+        )
+        if not advanced:
+            return False
+
+        unread = Message.objects.filter(
+            chat_id=chat_id,
+            sent_at__gt=message.sent_at
+        ).exclude(sender_id=user_id).count()
+        ChatUnreadCounter.objects.filter(chat_id=chat_id, user_id=user_id).update(
+            unread_count=unread
+        )
+        return True
         
     def __str__(self):
         return f"{self.user.username} in {self.chat}"
     
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Voice Note Model
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class VoiceNote(GenericModel):
+    """
+    فایل صوتی در storage (دیسک یا S3) نگه داشته می‌شود؛ پیام فقط به آن ارجاع می‌دهد
+    """
+    uploader = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="chat_voices",
+        verbose_name="uploader",
+        blank=True,
+        null=True
+    )
+    file = models.FileField(
+        'file',
+        upload_to='chat/voices/%Y/%m/'
+        )
+    content_type = models.CharField(
+        'content_type',
+        max_length=100,
+        default='audio/ogg'
+        )
+    size = models.PositiveBigIntegerField(
+        'size',
+        default=0
+        )
+    duration_ms = models.PositiveIntegerField(
+        'duration_ms',
+        blank=True,
+        null=True
+        )
+
+    class Meta:
+        verbose_name = "08-voice_note"
+        verbose_name_plural = "08-voice_notes"
+        db_table = 'chat_voice'
+
+    def __str__(self):
+        return f"Voice {self.id} ({self.size} bytes)"
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Message Model
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageQuerySet(models.QuerySet):
+    """
+    ترتیب‌های صریح پیام‌ها؛ هر کدام با یک ایندکس ترکیبی در Message.Meta
+    پوشش داده می‌شود تا Postgres به جای sort از index scan استفاده کند
+    """
+    def chat_history(self, chat_id):
+        """پیام‌های چت به ترتیب زمانی (chat_message_history_idx)"""
+        return self.filter(chat_id=chat_id).order_by('sent_at', 'id')
+
+    def latest_for_chat(self, chat_id):
+        """جدیدترین پیام‌ها اول؛ همان ایندکس تاریخچه به صورت backward scan"""
+        return self.filter(chat_id=chat_id).order_by('-sent_at', '-id')
+
+    def since_seq(self, chat_id, seq):
+        """پیام‌های بعد از یک شماره‌ی ترتیب (chat_message_seq_idx)"""
+        return self.filter(chat_id=chat_id, seq__gt=seq).order_by('seq')
+
+    def thread(self, root_id):
+        """همه‌ی پیام‌های رشته‌ی یک پیام ریشه به ترتیب زمانی (chat_message_thread_idx)"""
+        return self.filter(thread_root_id=root_id).order_by('sent_at', 'id')
+
 class Message(GenericModel):
     chat = models.ForeignKey(
         Chat, 
@@ -269,14 +571,17 @@ class Message(GenericModel):
         null=True, 
         blank=True
     )
-    voice = models.BinaryField(
-        'voice',
-        blank=True, 
+    voice = models.ForeignKey(
+        'VoiceNote',
+        on_delete=models.SET_NULL,
+        related_name='messages',
+        verbose_name='voice',
+        blank=True,
         null=True
-        ) 
+        )
     sent_at = models.DateTimeField(
         'sent_at',
-        auto_now_add=True
+        default=timezone.now
         )
     reply_to = models.ForeignKey(
         'self',
@@ -285,6 +590,23 @@ class Message(GenericModel):
         on_delete=models.SET_NULL,
         related_name='replies'
     )
+    # ریشه‌ی رشته‌ی پاسخ‌ها (برای پاسخِ پاسخ هم همان پیام اول)؛ در save پر می‌شود
+    thread_root = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='thread_messages',
+        editable=False,
+        # chat_message_thread_idx با thread_root شروع می‌شود
+        db_index=False
+    )
+    # تعداد کل پیام‌های رشته، فقط روی پیام ریشه
+    reply_count = models.PositiveIntegerField(
+        'reply_count',
+        default=0,
+        editable=False
+        )
     forward_from = models.ForeignKey(
         'self',
         null=True,
@@ -293,34 +615,280 @@ class Message(GenericModel):
         related_name='forwards'
     )
     is_edited = models.BooleanField(default=False)
-    sent_at = models.DateTimeField(auto_now_add=True)
+    # شماره‌ی یکنواخت پیام در چت (chat.sequence) برای resume سوکت‌ها
+    seq = models.PositiveBigIntegerField(
+        'seq',
+        blank=True,
+        null=True,
+        editable=False
+        )
+    # متن نرمال‌شده‌ی فارسی (chat.search.normalize_text) برای full-text search
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+        )
     
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
-        ordering = ['sent_at']
+        # بدون ordering پیش‌فرض؛ ترتیب با متدهای MessageQuerySet صریح است
+        indexes = [
+            # keyset pagination تاریخچه‌ی هر چت (chat_history / latest_for_chat)
+            models.Index(fields=['chat', 'sent_at', 'id'], name='chat_message_history_idx'),
+            # MessageQuerySet.thread
+            models.Index(fields=['thread_root', 'sent_at', 'id'], name='chat_message_thread_idx'),
+            # MessageQuerySet.since_seq (resume بعد از قطع اتصال)
+            models.Index(fields=['chat', 'seq'], name='chat_message_seq_idx'),
+            GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+        ]
         verbose_name = "06-chat_message"
         verbose_name_plural = "06-chat_messages"
         db_table = 'chat_message'
         
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.reply_to_id and not self.thread_root_id:
+            self.thread_root_id = self.resolve_thread_root()
+        if adding and self.chat_id and self.seq is None:
+            from chat.sequence import allocate_seqs
+            self.seq = allocate_seqs({self.chat_id: 1}).get(str(self.chat_id))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            # در همان INSERT/UPDATE محاسبه می‌شود، بدون کوئری جدا
+            self.search_vector = search_vector_for(self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = [*update_fields, 'search_vector']
+        super().save(*args, **kwargs)
+        if adding and self.thread_root_id:
+            Message.objects.filter(pk=self.thread_root_id).update(
+                reply_count=models.F('reply_count') + 1
+            )
+        if adding and self.chat_id:
+            Chat.record_messages(self.chat_id, 1, self)
+            self.notify_chat_members()
+
+        # write-through صفحه‌ی اول تاریخچه؛ ویرایش لیست cache شده را باطل می‌کند
+        from chat.history_cache import message_changed, message_created
+        if adding:
+            transaction.on_commit(lambda: message_created(self))
+        elif self.chat_id:
+            chat_id = self.chat_id
+            transaction.on_commit(lambda: message_changed(chat_id))
+
+    def delete(self, *args, **kwargs):
+        chat_id = self.chat_id
+        thread_root_id = self.thread_root_id
+        result = super().delete(*args, **kwargs)
+        if thread_root_id:
+            Message.objects.filter(pk=thread_root_id, reply_count__gt=0).update(
+                reply_count=models.F('reply_count') - 1
+            )
+        if chat_id:
+            latest = Message.objects.latest_for_chat(chat_id).first()
+            Chat.objects.filter(pk=chat_id).update(
+                message_count=models.F('message_count') - 1,
+                last_message=latest,
+                last_activity_at=latest.sent_at if latest else None,
+            )
+            from chat.history_cache import message_changed
+            transaction.on_commit(lambda: message_changed(chat_id))
+        return result
+
+    @classmethod
+    def forward(cls, source, sender, chats):
+        """
+        فوروارد یک پیام به چند چت با یک INSERT. ردیف‌های جدید فقط به پیام اصلی
+        (و VoiceNote آن) ارجاع می‌دهند و محتوا کپی نمی‌شود؛ فوروارد یک فوروارد
+        هم به همان پیام اصلی اشاره می‌کند.
+        """
+        origin = source.forward_from if source.forward_from_id else source
+        sent_at = timezone.now()
+        from chat.sequence import allocate_seqs
+        last_seqs = allocate_seqs({chat.id: 1 for chat in chats})
+        messages = cls.objects.bulk_create([
+            cls(
+                chat=chat,
+                sender=sender,
+                forward_from=origin,
+                voice=origin.voice if origin.voice_id else None,
+                sent_at=sent_at,
+                seq=last_seqs.get(str(chat.id)),
+            )
+            for chat in chats
+        ])
+
+        # bulk_create متد save را صدا نمی‌زند؛ شمارنده‌های همه‌ی چت‌ها با یک UPDATE
+        Chat.record_message_batches([(message.chat_id, 1, message, message.seq) for message in messages])
+        from chat.history_cache import messages_created
+        from chat.tasks import notify_new_messages
+        message_ids = [str(message.id) for message in messages]
+        transaction.on_commit(lambda: notify_new_messages.delay(message_ids))
+        transaction.on_commit(lambda: messages_created(messages))
+        return messages
+
+    def resolve_thread_root(self):
+        """ریشه‌ی رشته از پیامِ پاسخ داده شده؛ بدون پیمایش زنجیره‌ی reply_to"""
+        if 'reply_to' in self._state.fields_cache and self.reply_to is not None:
+            parent_root_id = self.reply_to.thread_root_id
+        else:
+            parent_root_id = Message.objects.filter(
+                pk=self.reply_to_id
+            ).values_list('thread_root_id', flat=True).first()
+        return parent_root_id or self.reply_to_id
+
     def notify_chat_members(self):
         """
         ارسال نوتیفیکیشن به تمام اعضای چت
-        به جز فرستنده پیام
+        به جز فرستنده پیام (در worker، به صورت شمارنده‌ی تجمیعی)
         """
-        if not self.chat or not self.sender:
+        if not self.chat_id or not self.sender_id:
             return
 
-        members = self.chat.active_memberships.exclude(user=self.sender)
+        from chat.tasks import notify_new_messages
+        message_ids = [str(self.id)]
+        transaction.on_commit(lambda: notify_new_messages.delay(message_ids))
 
-        for member in members:
-            Notifs.objects.create(
-                user=member.user,
-                title="پیام جدید",
-                description=(self.content or "")[:100],
-                notif_type="chat",
+    def __str__(self):
+        return f"Message from {self.sender}"
 
-                content_type=ContentType.objects.get_for_model(Message),
-                object_id=self.id,
-            )
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Message Archive Model
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageArchive(GenericModel):
+    """
+    یک پارتیشن ماهانه‌ی جدا شده از chat_message که به صورت JSONL فشرده در storage است
+    """
+    partition = models.CharField(
+        'partition',
+        max_length=63,
+        unique=True
+        )
+    period_start = models.DateTimeField('period_start')
+    period_end = models.DateTimeField('period_end')
+    file = models.FileField(
+        'file',
+        upload_to='chat/archive/'
+        )
+    compression = models.CharField(
+        'compression',
+        max_length=10,
+        default='gzip'
+        )
+    row_count = models.PositiveBigIntegerField(
+        'row_count',
+        default=0
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['period_start']),
+        ]
+        verbose_name = "09-message_archive"
+        verbose_name_plural = "09-message_archives"
+        db_table = 'chat_message_archive'
+
+    def __str__(self):
+        return f"{self.partition} ({self.row_count} rows)"
+
+
+class MessageArchiveBlock(GenericModel):
+    """
+    ایندکس هر چت در فایل آرشیو: فایل از بلوک‌های جدا فشرده شده (هر کدام حداکثر
+    ARCHIVE_BLOCK_ROWS پیام از یک چت) تشکیل شده و هر صفحه‌ی تاریخچه فقط
+    بلوک‌های لازم را با seek می‌خواند، نه کل فایل ماه را
+    """
+    archive = models.ForeignKey(
+        MessageArchive,
+        on_delete=models.CASCADE,
+        related_name='blocks',
+        verbose_name='archive'
+    )
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='chat'
+    )
+    first_sent_at = models.DateTimeField('first_sent_at')
+    last_sent_at = models.DateTimeField('last_sent_at')
+    offset = models.PositiveBigIntegerField('offset')
+    length = models.PositiveIntegerField('length')
+    row_count = models.PositiveIntegerField('row_count')
+
+    class Meta:
+        indexes = [
+            # load_archived_messages: بلوک‌های یک چت قبل از cursor، از جدید به قدیم
+            models.Index(fields=['chat', 'first_sent_at'], name='chat_archive_block_idx'),
+        ]
+        verbose_name = "10-message_archive_block"
+        verbose_name_plural = "10-message_archive_blocks"
+        db_table = 'chat_message_archive_block'
+
+    def __str__(self):
+        return f"{self.archive.partition} [{self.offset}:{self.offset + self.length}]"
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Unread Counter Model
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ChatUnreadCounter(GenericModel):
+    """
+    یک ردیف برای هر کاربر در هر چت، به جای یک نوتیف برای هر پیام جدید
+    """
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name="unread_counters",
+        verbose_name="chat"
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="chat_unread_counters",
+        verbose_name="user"
+    )
+    unread_count = models.PositiveIntegerField(
+        'unread_count',
+        default=0
+        )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name="last_message",
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        unique_together = ('chat', 'user')
+        verbose_name = "07-unread_counter"
+        verbose_name_plural = "07-unread_counters"
+        db_table = 'chat_unread_counter'
+
+    @classmethod
+    def bump(cls, chat_id, user_ids, last_message_id=None, step=1, batch_size=500):
+        """
+        افزایش شمارنده برای گروهی از کاربران با یک INSERT و یک UPDATE در هر batch
+        """
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            chunk = user_ids[start:start + batch_size]
+            with transaction.atomic():
+                existing = set(
+                    cls.objects.filter(chat_id=chat_id, user_id__in=chunk)
+                    .values_list('user_id', flat=True)
+                )
+                cls.objects.bulk_create(
+                    [
+                        cls(chat_id=chat_id, user_id=user_id)
+                        for user_id in chunk if user_id not in existing
+                    ],
+                    ignore_conflicts=True,
+                )
+                cls.objects.filter(chat_id=chat_id, user_id__in=chunk).update(
+                    unread_count=models.F('unread_count') + step,
+                    last_message_id=last_message_id,
+                )
 
     def __str__(self):
-        return f"Message from {self.sender}"
\ No newline at end of file
+        return f"{self.user} - {self.chat} ({self.unread_count})"
@@ -0,0 +1,196 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from chat.archive import load_archived_messages
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def encode_cursor(obj):
+    raw = f"{obj.sent_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(value):
+    try:
+        sent_at, pk = base64.urlsafe_b64decode(value.encode()).decode().split('|', 1)
+        sent_at = parse_datetime(sent_at)
+    except (ValueError, UnicodeDecodeError):
+        sent_at = None
+    if sent_at is None:
+        raise NotFound("cursor نامعتبر است")
+    return sent_at, pk
+
+def newer_than(sent_at, pk):
+    """
+    (sent_at, id) > cursor. شرط OR به تنهایی حد بازه روی chat_message_history_idx
+    نمی‌شود؛ sent_at__gte اضافه شده تا اسکن از همان cursor شروع شود
+    """
+    return Q(sent_at__gte=sent_at) & (Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, id__gt=pk))
+
+def older_than(sent_at, pk):
+    """(sent_at, id) < cursor با حد بازه‌ی sent_at__lte (مثل newer_than)"""
+    return Q(sent_at__lte=sent_at) & (Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, id__lt=pk))
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Message Keyset Pagination
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageKeysetPagination(BasePagination):
+    """
+    صفحه‌بندی keyset روی (sent_at, id) با پارامترهای before / after / limit.
+    بدون cursor جدیدترین پیام‌ها برمی‌گردند؛ نتیجه همیشه به ترتیب زمانی است.
+    """
+    default_limit = 50
+    max_limit = 200
+    before_query_param = 'before'
+    after_query_param = 'after'
+    limit_query_param = 'limit'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+
+        if after:
+            sent_at, pk = decode_cursor(after)
+            queryset = queryset.filter(newer_than(sent_at, pk)).order_by('sent_at', 'id')
+            rows = list(queryset[:self.limit + 1])
+            self.has_newer = len(rows) > self.limit
+            rows = rows[:self.limit]
+            self.has_older = True
+        else:
+            if before:
+                sent_at, pk = decode_cursor(before)
+                queryset = queryset.filter(older_than(sent_at, pk))
+            queryset = queryset.order_by('-sent_at', '-id')
+            rows = list(queryset[:self.limit + 1])
+            self.has_older = len(rows) > self.limit
+            if not self.has_older:
+                rows.extend(self.archived_rows(view, rows, before))
+                self.has_older = len(rows) > self.limit
+            rows = rows[:self.limit][::-1]
+            self.has_newer = bool(before)
+
+        self.page = rows
+        return rows
+
+    def archived_rows(self, view, rows, before):
+        """
+        ادامه‌ی تاریخچه از آرشیو (chat.archive) وقتی جدول زنده تمام شده است؛
+        فقط برای viewهایی که archive_chat_id دارند (تاریخچه‌ی یک چت)
+        """
+        chat_id = getattr(view, 'archive_chat_id', None)
+        if not chat_id:
+            return []
+        if rows:
+            cursor = (rows[-1].sent_at, rows[-1].id)
+        else:
+            cursor = decode_cursor(before) if before else None
+        return load_archived_messages(chat_id, cursor, self.limit - len(rows))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'before': encode_cursor(self.page[0]) if self.page and self.has_older else None,
+            'after': encode_cursor(self.page[-1]) if self.page else None,
+            'has_older': self.has_older,
+            'has_newer': self.has_newer,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'before': {'type': 'string', 'nullable': True},
+                'after': {'type': 'string', 'nullable': True},
+                'has_older': {'type': 'boolean'},
+                'has_newer': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': schema_type},
+            }
+            for name, schema_type in (
+                (self.before_query_param, 'string'),
+                (self.after_query_param, 'string'),
+                (self.limit_query_param, 'integer'),
+            )
+        ]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Search Keyset Pagination
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SearchKeysetPagination(MessageKeysetPagination):
+    """
+    صفحه‌بندی keyset روی (rank, id) برای نتایج جستجو؛ فقط cursor رو به جلو (after)
+    """
+    @staticmethod
+    def encode_rank_cursor(obj):
+        raw = f"{obj.rank!r}|{obj.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_rank_cursor(value):
+        try:
+            rank, pk = base64.urlsafe_b64decode(value.encode()).decode().split('|', 1)
+            return float(rank), pk
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound("cursor نامعتبر است")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        after = request.query_params.get(self.after_query_param)
+        if after:
+            rank, pk = self.decode_rank_cursor(after)
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+        rows = list(queryset.order_by('-rank', '-id')[:self.limit + 1])
+        self.has_more = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'after': self.encode_rank_cursor(self.page[-1]) if self.page and self.has_more else None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'after': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': schema_type},
+            }
+            for name, schema_type in (
+                (self.after_query_param, 'string'),
+                (self.limit_query_param, 'integer'),
+            )
+        ]
+
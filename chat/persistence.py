@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from chat.history_cache import messages_created
+from chat.models import Chat, Message
+from chat.search import search_vector_for
+from chat.sequence import allocate_seqs
+
+logger = logging.getLogger(__name__)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+def build_message_row(chat_id, sender_id, content=None, voice_id=None, seq=None):
+    """
+    شناسه، زمان و seq پیام در سرور تعیین می‌شود تا قبل از ذخیره broadcast شود
+    """
+    return {
+        'id': str(uuid.uuid4()),
+        'chat_id': str(chat_id),
+        'sender_id': str(sender_id) if sender_id else None,
+        'content': content,
+        'voice_id': str(voice_id) if voice_id else None,
+        'sent_at': timezone.now().isoformat(),
+        'seq': seq,
+    }
+
+def insert_new_messages(messages):
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING id و برگرداندن فقط پیام‌هایی که
+    واقعا نوشته شدند. bulk_create(ignore_conflicts=True) همه‌ی اشیا را برمی‌گرداند،
+    حتی تکراری‌هایی که رد شده‌اند؛ برای همین از همان مسیر داخلی bulk_create
+    (QuerySet._insert) با returning_fields استفاده می‌شود.
+    """
+    fields = [field for field in Message._meta.concrete_fields if not field.generated]
+    inserted = Message.objects._insert(
+        messages,
+        fields=fields,
+        returning_fields=[Message._meta.pk],
+        on_conflict=OnConflict.IGNORE,
+    )
+    # برای یک شیء _insert نتیجه‌ی fetchone را برمی‌گرداند که در تکراری بودن None است
+    inserted_ids = {str(row[0]) for row in inserted if row is not None}
+    messages = [message for message in messages if str(message.pk) in inserted_ids]
+    for message in messages:
+        message._state.adding = False
+    return messages
+
+def write_messages(rows):
+    """
+    نوشتن یک batch با یک INSERT. ردیف‌های تکراری (بازیابی از stream) نادیده گرفته
+    می‌شوند و شمارنده‌ها، نوتیف و history cache فقط برای ردیف‌های جدید اعمال می‌شوند
+    """
+    # ردیف‌هایی که seq ندارند (write-behind بدون Redis برای seq) برای هر چت یک بار رزرو می‌کنند
+    missing = {}
+    for row in rows:
+        if row.get('seq') is None:
+            missing.setdefault(row['chat_id'], []).append(row)
+    last_seqs = allocate_seqs({chat_id: len(chat_rows) for chat_id, chat_rows in missing.items()})
+    for chat_id, chat_rows in missing.items():
+        last_seq = last_seqs.get(str(chat_id))
+        if last_seq is None:
+            continue
+        for seq, row in enumerate(chat_rows, start=last_seq - len(chat_rows) + 1):
+            row['seq'] = seq
+
+    messages = insert_new_messages([
+        Message(
+            id=row['id'],
+            chat_id=row['chat_id'],
+            sender_id=row['sender_id'],
+            content=row['content'],
+            voice_id=row['voice_id'],
+            sent_at=parse_datetime(row['sent_at']),
+            seq=row['seq'],
+            search_vector=search_vector_for(row['content']),
+        )
+        for row in rows
+    ])
+    if not messages:
+        return messages
+
+    # شمارنده‌های همه‌ی چت‌های batch با یک UPDATE (save صدا زده نمی‌شود)
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    Chat.record_message_batches([
+        (
+            chat_id,
+            len(chat_messages),
+            max(chat_messages, key=lambda message: message.sent_at),
+            max(message.seq for message in chat_messages),
+        )
+        for chat_id, chat_messages in by_chat.items()
+    ])
+
+    from chat.tasks import notify_new_messages
+    message_ids = [str(message.id) for message in messages]
+    transaction.on_commit(lambda: notify_new_messages.delay(message_ids))
+    transaction.on_commit(lambda: messages_created(messages, prefetch=True))
+    return messages
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Redis keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# chat:write_behind:workers          SET     workerهایی که stream دارند
+# chat:write_behind:stream:<worker>  STREAM  ردیف‌های ذخیره نشده‌ی همان worker
+# chat:write_behind:alive:<worker>   STRING  heartbeat با TTL؛ نبودنش یعنی worker مرده است
+# chat:write_behind:dead             STREAM  ردیف‌هایی که نوشته نمی‌شوند (dead-letter)
+RECOVERY_GROUP = 'recovery'
+
+# خطاهایی که مربوط به خود ردیف است (FK حذف شده، داده‌ی نامعتبر)، نه قطعی دیتابیس
+POISON_ERRORS = (IntegrityError, DataError, ValidationError, ValueError, TypeError, KeyError)
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def write_batch(rows):
+    """
+    نوشتن batch در یک تراکنش؛ اگر یک ردیف خراب باشد batch ردیف به ردیف
+    تکرار می‌شود تا بقیه نوشته شوند. ردیف‌های رد شده [(row, error)] برگردانده می‌شوند.
+    خطاهای دیگر (مثلا قطعی دیتابیس) بالا می‌روند تا کل batch بعدا دوباره امتحان شود.
+    """
+    try:
+        with transaction.atomic():
+            write_messages(rows)
+        return []
+    except POISON_ERRORS as error:
+        if len(rows) == 1:
+            return [(rows[0], repr(error))]
+
+    rejected = []
+    for row in rows:
+        try:
+            with transaction.atomic():
+                write_messages([row])
+        except POISON_ERRORS as error:
+            rejected.append((row, repr(error)))
+    return rejected
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Write-Behind Writer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageWriteBehind:
+    """
+    صف پیام‌های هر worker که هر flush_interval میلی‌ثانیه یا هر batch_size پیام
+    با bulk_create ذخیره می‌شود. وقتی صف پر شود submit منتظر می‌ماند (back-pressure).
+    اگر stream_url تنظیم شده باشد، هر پیام قبل از ack در stream همین worker
+    نگه داشته می‌شود. stream workerهایی که heartbeat ندارند (crash) توسط
+    workerهای زنده با consumer group (XREADGROUP / XAUTOCLAIM / XACK) نوشته
+    می‌شود؛ ردیف‌های در جریانِ workerهای زنده هیچ‌وقت دوباره نوشته نمی‌شوند.
+    """
+    def __init__(self, flush_interval_ms=50, batch_size=200, max_pending=5000,
+                 stream_url=None, key_prefix='chat:write_behind', heartbeat_ttl=30):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.stream_url = stream_url
+        self.key_prefix = key_prefix
+        self.heartbeat_ttl = heartbeat_ttl
+        self.worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stream_key = self.stream_key_for(self.worker)
+        self.queue = None
+        self.redis = None
+        self._started = False
+        self._tasks = []
+
+    # -----------------------------------
+    # Keys
+    # -----------------------------------
+    def stream_key_for(self, worker):
+        return f'{self.key_prefix}:stream:{worker}'
+
+    def alive_key_for(self, worker):
+        return f'{self.key_prefix}:alive:{worker}'
+
+    @property
+    def workers_key(self):
+        return f'{self.key_prefix}:workers'
+
+    @property
+    def dead_letter_key(self):
+        return f'{self.key_prefix}:dead'
+
+    # -----------------------------------
+    # Lifecycle
+    # -----------------------------------
+    async def start(self):
+        """
+        بازیابی در پس‌زمینه انجام می‌شود؛ خطای آن فقط log می‌شود و submit را از کار نمی‌اندازد
+        """
+        if self._started:
+            return
+        self._started = True
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        loop = asyncio.get_running_loop()
+        if self.stream_url:
+            import redis.asyncio as redis
+            self.redis = redis.from_url(self.stream_url)
+            self._tasks.append(loop.create_task(self._heartbeat()))
+        self._tasks.append(loop.create_task(self._run()))
+
+    async def submit(self, row):
+        await self.start()
+        entry_id = None
+        if self.redis is not None:
+            entry_id = await self.redis.xadd(self.stream_key, {'row': json.dumps(row)})
+        await self.queue.put((entry_id, row))
+
+    async def _heartbeat(self):
+        interval = self.heartbeat_ttl / 3
+        while True:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.set(self.alive_key_for(self.worker), 1, ex=self.heartbeat_ttl)
+                pipe.sadd(self.workers_key, self.worker)
+                await pipe.execute()
+                await self.recover()
+            except Exception:
+                logger.exception("write-behind: heartbeat/recovery failed")
+            await asyncio.sleep(interval)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.flush_with_retry(batch)
+
+    async def flush_with_retry(self, batch):
+        """
+        خطای غیر از ردیف خراب (قطعی دیتابیس) batch را دور نمی‌اندازد؛ با backoff
+        دوباره امتحان می‌شود و در این مدت صف پر شده و submit منتظر می‌ماند
+        """
+        delay = self.flush_interval
+        while True:
+            try:
+                return await self.flush(batch)
+            except Exception:
+                logger.exception("write-behind: flush of %s messages failed, retrying", len(batch))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    # -----------------------------------
+    # Flush
+    # -----------------------------------
+    async def flush(self, batch, stream_key=None, acknowledge=False):
+        rejected = await database_sync_to_async(write_batch)([row for _, row in batch])
+        for row, error in rejected:
+            logger.error("write-behind: dropping message %s: %s", row.get('id'), error)
+            if self.redis is not None:
+                await self.redis.xadd(self.dead_letter_key, {'row': json.dumps(row), 'error': error})
+
+        entry_ids = [entry_id for entry_id, _ in batch if entry_id is not None]
+        if entry_ids and self.redis is not None:
+            stream_key = stream_key or self.stream_key
+            pipe = self.redis.pipeline()
+            if acknowledge:
+                pipe.xack(stream_key, RECOVERY_GROUP, *entry_ids)
+            pipe.xdel(stream_key, *entry_ids)
+            await pipe.execute()
+
+    # -----------------------------------
+    # Recovery
+    # -----------------------------------
+    async def recover(self):
+        """stream workerهایی که heartbeat ندارند (crash کرده‌اند) نوشته و پاک می‌شود"""
+        for worker in await self.redis.smembers(self.workers_key):
+            worker = decode(worker)
+            if worker == self.worker or await self.redis.exists(self.alive_key_for(worker)):
+                continue
+            await self.recover_stream(worker)
+
+    async def recover_stream(self, worker):
+        from redis.exceptions import ResponseError
+        key = self.stream_key_for(worker)
+        try:
+            await self.redis.xgroup_create(key, RECOVERY_GROUP, id='0', mkstream=True)
+        except ResponseError as error:
+            if 'BUSYGROUP' not in str(error):
+                raise
+
+        # ردیف‌هایی که worker بازیابی دیگری گرفته و خودش هم مرده است
+        while True:
+            result = await self.redis.xautoclaim(
+                key, RECOVERY_GROUP, self.worker,
+                min_idle_time=self.heartbeat_ttl * 1000, start_id='0-0', count=self.batch_size,
+            )
+            entries = [entry for entry in result[1] if entry[1]]
+            if not entries:
+                break
+            await self.flush_entries(key, entries)
+
+        # هر ردیف فقط به یکی از workerهای بازیابی‌کننده تحویل داده می‌شود
+        while True:
+            response = await self.redis.xreadgroup(
+                RECOVERY_GROUP, self.worker, {key: '>'}, count=self.batch_size,
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                break
+            await self.flush_entries(key, entries)
+
+        pending = await self.redis.xpending(key, RECOVERY_GROUP)
+        if not pending['pending'] and not await self.redis.xlen(key):
+            pipe = self.redis.pipeline()
+            pipe.delete(key)
+            pipe.srem(self.workers_key, worker)
+            await pipe.execute()
+
+    async def flush_entries(self, key, entries):
+        logger.info("write-behind: recovering %s messages from %s", len(entries), key)
+        await self.flush(
+            [(entry_id, json.loads(fields[b'row'])) for entry_id, fields in entries],
+            stream_key=key,
+            acknowledge=True,
+        )
+
+_writer = None
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        _writer = MessageWriteBehind(
+            flush_interval_ms=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_MS', 50),
+            batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 200),
+            max_pending=getattr(settings, 'CHAT_WRITE_BEHIND_MAX_PENDING', 5000),
+            stream_url=getattr(settings, 'CHAT_WRITE_BEHIND_STREAM_URL', None),
+            heartbeat_ttl=getattr(settings, 'CHAT_WRITE_BEHIND_HEARTBEAT_TTL', 30),
+        )
+    return _writer
@@ -0,0 +1,125 @@
+import time
+from django.conf import settings
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Redis keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# presence:user:<user_id>   ZSET  "<chat_id>|<channel_name>" -> expires_at
+# presence:chat:<chat_id>   ZSET  "<user_id>"                -> expires_at
+# typing:chat:<chat_id>     ZSET  "<user_id>"                -> expires_at
+# typing:lock:<chat_id>     STRING (NX, PX=interval)  یک broadcast در هر بازه
+# typing:rl:<chat_id>:<uid> STRING (NX, PX)           rate-limit هر کاربر
+def user_key(user_id):
+    return f'presence:user:{user_id}'
+
+def chat_key(chat_id):
+    return f'presence:chat:{chat_id}'
+
+def typing_key(chat_id):
+    return f'typing:chat:{chat_id}'
+
+def presence_redis_url():
+    return getattr(settings, 'CHAT_PRESENCE_REDIS_URL', None)
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Presence Service
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class PresenceService:
+    """
+    حضور آنلاین و typing در Redis؛ هیچ چیزی در Postgres نوشته نمی‌شود.
+    هر سوکت (روی هر node) یک عضو در presence:user است، پس کاربر با چند سوکت
+    فقط وقتی آفلاین می‌شود که آخرین سوکتش بسته یا منقضی شود.
+    """
+    def __init__(self, redis, ttl=60, typing_interval_ms=2000):
+        self.redis = redis
+        self.ttl = ttl
+        self.typing_interval_ms = typing_interval_ms
+
+    async def connect(self, user_id, chat_id, channel_name):
+        """True اگر این اولین سوکت کاربر در این چت باشد"""
+        was_online = await self.is_online_in_chat(user_id, chat_id)
+        await self.heartbeat(user_id, chat_id, channel_name)
+        return not was_online
+
+    async def heartbeat(self, user_id, chat_id, channel_name):
+        expires_at = time.time() + self.ttl
+        pipe = self.redis.pipeline()
+        pipe.zadd(user_key(user_id), {f'{chat_id}|{channel_name}': expires_at})
+        pipe.expire(user_key(user_id), self.ttl * 2)
+        pipe.zadd(chat_key(chat_id), {str(user_id): expires_at})
+        pipe.expire(chat_key(chat_id), self.ttl * 2)
+        await pipe.execute()
+
+    async def disconnect(self, user_id, chat_id, channel_name):
+        """True اگر کاربر دیگر هیچ سوکتی در این چت نداشته باشد"""
+        await self.redis.zrem(user_key(user_id), f'{chat_id}|{channel_name}')
+        if await self.is_online_in_chat(user_id, chat_id):
+            return False
+        await self.redis.zrem(chat_key(chat_id), str(user_id))
+        return True
+
+    async def is_online_in_chat(self, user_id, chat_id):
+        await self.redis.zremrangebyscore(user_key(user_id), '-inf', time.time())
+        prefix = f'{chat_id}|'
+        connections = await self.redis.zrange(user_key(user_id), 0, -1)
+        return any(decode(member).startswith(prefix) for member in connections)
+
+    async def online_members(self, chat_id):
+        now = time.time()
+        await self.redis.zremrangebyscore(chat_key(chat_id), '-inf', now)
+        return [decode(member) for member in await self.redis.zrange(chat_key(chat_id), 0, -1)]
+
+    # -----------------------------------
+    # Typing
+    # -----------------------------------
+    async def typing(self, chat_id, user_id):
+        """
+        ثبت typing کاربر. True یعنی این فراخوانی قفل broadcast این بازه را گرفته
+        و باید بعد از typing_interval_ms یک رویداد تجمیعی بفرستد.
+        """
+        interval = self.typing_interval_ms
+        allowed = await self.redis.set(
+            f'typing:rl:{chat_id}:{user_id}', 1, nx=True, px=max(interval // 2, 1)
+        )
+        if not allowed:
+            return False
+
+        await self.redis.zadd(typing_key(chat_id), {str(user_id): time.time() + interval / 1000})
+        await self.redis.pexpire(typing_key(chat_id), interval * 2)
+        return bool(await self.redis.set(f'typing:lock:{chat_id}', 1, nx=True, px=interval))
+
+    async def typing_members(self, chat_id):
+        await self.redis.zremrangebyscore(typing_key(chat_id), '-inf', time.time())
+        return [decode(member) for member in await self.redis.zrange(typing_key(chat_id), 0, -1)]
+
+_presence = None
+
+def get_presence():
+    """None یعنی presence غیرفعال است (CHAT_PRESENCE_REDIS_URL تنظیم نشده)"""
+    global _presence
+    if _presence is None and presence_redis_url():
+        import redis.asyncio as redis
+        _presence = PresenceService(
+            redis.from_url(presence_redis_url()),
+            ttl=getattr(settings, 'CHAT_PRESENCE_TTL', 60),
+            typing_interval_ms=getattr(settings, 'CHAT_TYPING_INTERVAL_MS', 2000),
+        )
+    return _presence
+
+_sync_client = None
+
+def get_online_members(chat_id):
+    """نسخه‌ی sync برای viewها؛ بدون اسکن ChatMembership"""
+    global _sync_client
+    if not presence_redis_url():
+        return []
+    if _sync_client is None:
+        import redis
+        _sync_client = redis.from_url(presence_redis_url())
+    return [
+        decode(member)
+        for member in _sync_client.zrangebyscore(chat_key(chat_id), time.time(), '+inf')
+    ]
@@ -0,0 +1,113 @@
+from collections import deque
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from chat.models import Message
+from chat.sequence import get_allocator
+from chat.serializers import MessageRealtimeSerializer
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Redis keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# chat:replay:<chat_id>   ZSET  frame -> seq   (آخرین CHAT_REPLAY_BUFFER_SIZE پیام)
+def replay_key(chat_id):
+    return f'chat:replay:{chat_id}'
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Replay Buffer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ReplayBuffer:
+    """
+    حلقه‌ی محدود frameهای اخیر هر چت بر اساس seq. با Redis بین workerها
+    مشترک است؛ بدون Redis فقط در حافظه‌ی همین worker نگه داشته می‌شود.
+    """
+    def __init__(self, redis=None, size=500, ttl=24 * 60 * 60):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+        self.local = {}
+
+    async def append(self, chat_id, seq, frame):
+        if self.redis is None:
+            self.local.setdefault(str(chat_id), deque(maxlen=self.size)).append((seq, frame))
+            return
+        key = replay_key(chat_id)
+        pipe = self.redis.pipeline()
+        pipe.zadd(key, {frame: seq})
+        pipe.zremrangebyrank(key, 0, -(self.size + 1))
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def since(self, chat_id, seq, last_seq):
+        """
+        frameهای seq+1 تا last_seq (آخرین seq داده شده) به ترتیب؛ None یعنی
+        buffer این بازه را بی‌فاصله ندارد (بیرون افتاده، پیامی هنوز append نشده
+        یا buffer خالی است) و باید از دیتابیس خوانده شود
+        """
+        if last_seq is None or seq >= last_seq:
+            return []
+        if last_seq - seq > self.size:
+            return None
+        if self.redis is None:
+            entries = sorted(self.local.get(str(chat_id), ()))
+            missed = [(entry_seq, frame) for entry_seq, frame in entries if seq < entry_seq <= last_seq]
+        else:
+            frames = await self.redis.zrangebyscore(replay_key(chat_id), f'({seq}', last_seq, withscores=True)
+            missed = [(int(score), decode(frame)) for frame, score in frames]
+
+        if [entry_seq for entry_seq, frame in missed] != list(range(seq + 1, last_seq + 1)):
+            return None
+        return [frame for entry_seq, frame in missed]
+
+_buffer = None
+
+def get_replay_buffer():
+    global _buffer
+    if _buffer is None:
+        redis_url = getattr(settings, 'CHAT_REPLAY_REDIS_URL', None)
+        client = None
+        if redis_url:
+            import redis.asyncio as redis
+            client = redis.from_url(redis_url)
+        _buffer = ReplayBuffer(
+            client,
+            size=getattr(settings, 'CHAT_REPLAY_BUFFER_SIZE', 500),
+            ttl=getattr(settings, 'CHAT_REPLAY_TTL', 24 * 60 * 60),
+        )
+    return _buffer
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Resume
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@database_sync_to_async
+def frames_from_database(chat_id, seq, limit):
+    """fallback وقتی فاصله از buffer بیرون افتاده؛ range scan روی chat_message_seq_idx"""
+    messages = list(Message.objects.since_seq(chat_id, seq)[:limit + 1])
+    frames = [
+        MessageRealtimeSerializer.encode(MessageRealtimeSerializer.to_dict(message))
+        for message in messages[:limit]
+    ]
+    return frames, len(messages) > limit
+
+def append_message(message):
+    """پیام‌هایی که از REST ساخته می‌شوند (بعد از commit) هم برای resume در buffer می‌آیند"""
+    if message.seq is None:
+        return
+    frame = MessageRealtimeSerializer.encode(MessageRealtimeSerializer.to_dict(message))
+    async_to_sync(get_replay_buffer().append)(message.chat_id, message.seq, frame)
+
+async def missed_frames(chat_id, seq):
+    """
+    (frames, truncated) پیام‌های بعد از seq. truncated یعنی فاصله بیشتر از
+    CHAT_RESUME_MAX_MESSAGES است و بقیه باید از API تاریخچه خوانده شود.
+    ممکن است یک پیام هم از replay و هم زنده برسد؛ کلاینت با seq حذف تکراری می‌کند.
+    """
+    limit = getattr(settings, 'CHAT_RESUME_MAX_MESSAGES', 500)
+    last_seq = await get_allocator().current(chat_id)
+    frames = await get_replay_buffer().since(chat_id, seq, last_seq)
+    if frames is not None and len(frames) <= limit:
+        return frames, False
+    return await frames_from_database(chat_id, seq, limit)
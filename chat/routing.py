@@ -1,6 +1,7 @@
-from django.urls import re_path
+from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r'ws/chat/(?P<chat_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    path('ws/chat/', consumers.UserConsumer.as_asgi()),
+    path('ws/chat/<uuid:chat_id>/', consumers.ChatConsumer.as_asgi()),
 ]
@@ -0,0 +1,57 @@
+import re
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    )
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast
+from persiantools import characters, digits
+
+SEARCH_CONFIG = 'simple'
+ZWNJ = '\u200c'
+# اعراب عربی و کشیده (ـ)
+DIACRITICS_RE = re.compile('[\u064B-\u065F\u0670\u0640]')
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def normalize_text(text):
+    """
+    یکسان‌سازی متن فارسی برای ایندکس و جستجو:
+    ي/ك عربی به ی/ک فارسی، حذف نیم‌فاصله (می‌روم = میروم)، حذف اعراب و ارقام به لاتین
+    """
+    if not text:
+        return ''
+    text = characters.ar_to_fa(text)
+    text = digits.fa_to_en(digits.ar_to_en(text))
+    text = text.replace(ZWNJ, '')
+    text = DIACRITICS_RE.sub('', text)
+    return text.lower()
+
+def search_vector_for(text):
+    """expression برای ستون search_vector؛ در INSERT/UPDATE همان کوئری محاسبه می‌شود"""
+    return SearchVector(Value(normalize_text(text)), config=SEARCH_CONFIG)
+
+def build_search_query(term):
+    return SearchQuery(normalize_text(term), config=SEARCH_CONFIG, search_type='websearch')
+
+def search_messages(queryset, term):
+    """
+    فیلتر با ایندکس GIN روی search_vector، همراه با rank و snippet هایلایت شده
+    """
+    query = build_search_query(term)
+    return queryset.filter(search_vector=query).annotate(
+        # double precision تا مقایسه‌ی cursor روی rank دقیق باشد
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+        snippet=SearchHeadline(
+            'content',
+            query,
+            config=SEARCH_CONFIG,
+            start_sel='<mark>',
+            stop_sel='</mark>',
+            max_words=20,
+            min_words=5,
+        ),
+    )
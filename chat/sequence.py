@@ -0,0 +1,126 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from chat.models import Chat
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Redis keys
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# chat:seq:<chat_id>  INT  آخرین seq داده شده در چت (بدون TTL)
+def seq_key(chat_id):
+    return f'chat:seq:{chat_id}'
+
+# کلید نبود: با Chat.last_seq (ARGV[2]) مقداردهی می‌شود؛ بدون آن nil برمی‌گردد
+SEQ_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ARGV[2] == '' then
+        return false
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'NX')
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+def seq_floors(chat_ids):
+    """{str(chat_id): last_seq} از دیتابیس برای کلیدهایی که در Redis نیستند"""
+    return {
+        str(chat_id): last_seq
+        for chat_id, last_seq in Chat.objects.filter(pk__in=chat_ids).values_list('pk', 'last_seq')
+    }
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Sequence Allocator
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SequenceAllocator:
+    """
+    رزرو seq پیام‌ها. با redis_url هر چت یک شمارنده‌ی INCRBY در Redis دارد و
+    ارسال پیام UPDATE روی ردیف چت نمی‌گیرد؛ Chat.last_seq فقط high-water mark
+    است (record_message_batches) و وقتی کلید نیست شمارنده از آن ادامه می‌دهد.
+    بدون redis_url همان UPDATE ... RETURNING روی دیتابیس (Chat.allocate_seqs).
+    همه‌ی مسیرهای ساخت پیام باید از همین allocator بگیرند تا seq تکراری نشود.
+    """
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url
+        self._client = None
+        self._async_client = None
+
+    @property
+    def enabled(self):
+        return bool(self.redis_url)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.from_url(self.redis_url)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import redis.asyncio as redis
+            self._async_client = redis.from_url(self.redis_url)
+        return self._async_client
+
+    @staticmethod
+    def queue(pipe, counts, floors):
+        chat_ids = [str(chat_id) for chat_id in counts]
+        for chat_id in chat_ids:
+            floor = floors.get(chat_id)
+            pipe.eval(SEQ_SCRIPT, 1, seq_key(chat_id), counts[chat_id], '' if floor is None else floor)
+        return chat_ids
+
+    def allocate(self, counts):
+        """counts: {chat_id: count} و خروجی {str(chat_id): last_seq} مثل Chat.allocate_seqs"""
+        if not counts:
+            return {}
+        if not self.enabled:
+            return Chat.allocate_seqs(counts)
+        counts = {str(chat_id): count for chat_id, count in counts.items()}
+        last_seqs = self.run(counts, {})
+        missing = [chat_id for chat_id, last_seq in last_seqs.items() if last_seq is None]
+        if missing:
+            floors = seq_floors(missing)
+            last_seqs.update(self.run({chat_id: counts[chat_id] for chat_id in missing}, floors))
+        return {chat_id: int(last_seq) for chat_id, last_seq in last_seqs.items() if last_seq is not None}
+
+    def run(self, counts, floors):
+        pipe = self.client.pipeline(transaction=False)
+        chat_ids = self.queue(pipe, counts, floors)
+        return dict(zip(chat_ids, pipe.execute()))
+
+    async def allocate_async(self, counts):
+        if not counts:
+            return {}
+        if not self.enabled:
+            return await database_sync_to_async(Chat.allocate_seqs)(counts)
+        counts = {str(chat_id): count for chat_id, count in counts.items()}
+        last_seqs = await self.run_async(counts, {})
+        missing = [chat_id for chat_id, last_seq in last_seqs.items() if last_seq is None]
+        if missing:
+            floors = await database_sync_to_async(seq_floors)(missing)
+            last_seqs.update(await self.run_async({chat_id: counts[chat_id] for chat_id in missing}, floors))
+        return {chat_id: int(last_seq) for chat_id, last_seq in last_seqs.items() if last_seq is not None}
+
+    async def run_async(self, counts, floors):
+        pipe = self.async_client.pipeline(transaction=False)
+        chat_ids = self.queue(pipe, counts, floors)
+        return dict(zip(chat_ids, await pipe.execute()))
+
+    async def current(self, chat_id):
+        """آخرین seq داده شده در چت (None یعنی چت وجود ندارد)"""
+        if self.enabled:
+            last_seq = await self.async_client.get(seq_key(chat_id))
+            if last_seq is not None:
+                return int(last_seq)
+        return (await database_sync_to_async(seq_floors)([chat_id])).get(str(chat_id))
+
+_allocator = None
+
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        _allocator = SequenceAllocator(getattr(settings, 'CHAT_SEQ_REDIS_URL', None))
+    return _allocator
+
+def allocate_seqs(counts):
+    return get_allocator().allocate(counts)
@@ -1,3 +1,4 @@
+import json
 from typing import Any
 from rest_framework import serializers
 from authentication.serializers import GenericModelSerializer
@@ -6,11 +7,32 @@ from chat.models import (
     ChatMembership, 
     Message, 
     Profile, 
+    VoiceNote,
     )
+from chat.media import voice_max_bytes
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+# encoder سریع‌تر اگر نصب باشد (orjson / msgspec)، در غیر این صورت json استاندارد
+try:
+    import orjson
+
+    def encode_frame(payload):
+        return orjson.dumps(payload).decode()
+except ImportError:
+    try:
+        import msgspec
+
+        _msgspec_encoder = msgspec.json.Encoder()
+
+        def encode_frame(payload):
+            return _msgspec_encoder.encode(payload).decode()
+    except ImportError:
+        def encode_frame(payload):
+            return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Profile Serializer
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -24,6 +46,41 @@ class ProfileSerializer(serializers.ModelSerializer):
         )
         read_only_fields = fields
         
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Voice Note Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class VoiceNoteSerializer(serializers.ModelSerializer):
+    file = serializers.FileField(write_only=True)
+
+    class Meta:
+        model = VoiceNote
+        fields = (
+            "id",
+            "file",
+            "content_type",
+            "size",
+            "duration_ms",
+        )
+        read_only_fields = (
+            "id",
+            "content_type",
+            "size",
+        )
+
+    def validate_file(self, value):
+        if value.size > voice_max_bytes():
+            raise serializers.ValidationError("حجم فایل صوتی بیش از حد مجاز است")
+        content_type = getattr(value, 'content_type', None) or ''
+        if content_type and not content_type.startswith('audio/'):
+            raise serializers.ValidationError("فقط فایل صوتی مجاز است")
+        return value
+
+    def create(self, validated_data):
+        upload = validated_data['file']
+        validated_data['size'] = upload.size
+        validated_data['content_type'] = getattr(upload, 'content_type', None) or 'audio/ogg'
+        return super().create(validated_data)
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Message Serializer
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -34,6 +91,38 @@ class MessageSerializer(serializers.ModelSerializer):
         )
     reply_to_detail = serializers.SerializerMethodField()
     forward_from_detail = serializers.SerializerMethodField()
+    voice_detail = serializers.SerializerMethodField()
+
+    # ستون‌هایی که MessageViewSet با select_related/only می‌خواند تا هر ردیف کوئری اضافه نزند
+    QUERYSET_FIELDS = (
+        "id",
+        "chat_id",
+        "sender_id",
+        "content",
+        "voice_id",
+        "reply_to_id",
+        "forward_from_id",
+        "thread_root_id",
+        "reply_count",
+        "is_edited",
+        "sent_at",
+        "sender__id",
+        "sender__profile_chat__id",
+        "sender__profile_chat__user_id",
+        "sender__profile_chat__avatar",
+        "sender__profile_chat__bio",
+        "reply_to__id",
+        "reply_to__sender_id",
+        "reply_to__content",
+        "forward_from__id",
+        "forward_from__sender_id",
+        "forward_from__content",
+        "forward_from__voice_id",
+        "voice__id",
+        "voice__content_type",
+        "voice__size",
+        "voice__duration_ms",
+    )
     
     class Meta:
         model = Message
@@ -43,41 +132,218 @@ class MessageSerializer(serializers.ModelSerializer):
             "content",
             "voice",
             "reply_to",
+            "thread_root",
+            "reply_count",
             "is_edited",
             'sender_profile',
             'forward_from_detail',
             'reply_to_detail',
+            'voice_detail',
             "sent_at"
         )
+        read_only_fields = ("thread_root", "reply_count", "sent_at")
         # read_only_fields = fields
 
+    @staticmethod
+    def _flat_detail(message):
+        # فقط ستون‌های خود پیام؛ sender_id بدون join روی user خوانده می‌شود
+        if message is None:
+            return None
+        return {
+            "id": str(message.id),
+            "sender": str(message.sender_id) if message.sender_id else None,
+            "content": message.content,
+        }
+
+    @staticmethod
+    def absolute_urls(data, request):
+        """
+        history_cache داده را بدون request نگه می‌دارد (آدرس نسبی فایل‌ها)؛ در زمان
+        پاسخ آدرس‌ها مثل خروجی serializer با request کامل می‌شوند
+        """
+        profile = data.get('sender_profile')
+        if profile and profile.get('avatar'):
+            profile['avatar'] = request.build_absolute_uri(profile['avatar'])
+        return data
+
+    def validate_voice(self, value):
+        # فقط فایل صوتی‌ای که خود کاربر آپلود کرده قابل ارسال است
+        request = self.context.get('request')
+        if value and request and value.uploader_id != request.user.pk:
+            raise serializers.ValidationError("فایل صوتی نامعتبر است")
+        return value
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            # بعد از ارسال، reply_to و chat ثابت‌اند؛ thread_root و reply_count ریشه‌ها
+            # فقط در INSERT (Message.save) محاسبه می‌شوند و با PATCH کهنه می‌شدند
+            attrs.pop('reply_to', None)
+            attrs.pop('chat', None)
+
+        # رشته‌ها (thread_root) نباید از مرز چت عبور کنند
+        reply_to = attrs.get('reply_to')
+        if reply_to:
+            chat = attrs.get('chat') or getattr(self.instance, 'chat', None)
+            view = self.context.get('view')
+            chat_id = chat.pk if chat else (view.kwargs.get('chat_id') if view else None)
+            if chat_id and str(reply_to.chat_id) != str(chat_id):
+                raise serializers.ValidationError({"reply_to": "پیام در این چت نیست"})
+        return attrs
+
+    def get_voice_detail(self, obj):
+        # بایت‌های صوت هیچ‌وقت در تاریخچه نمی‌آیند؛ پخش از voices/<id>/stream/
+        if not obj.voice_id:
+            return None
+        return {
+            "id": str(obj.voice.id),
+            "content_type": obj.voice.content_type,
+            "size": obj.voice.size,
+            "duration_ms": obj.voice.duration_ms,
+        }
+
     def get_reply_to_detail(self, obj):
-        if obj.reply_to:
-            return {
-                "id": str(obj.reply_to.id),
-                "sender": str(obj.reply_to.sender.id) if obj.reply_to.sender else None,
-                "content": obj.reply_to.content,
-            }
-        return None
+        return self._flat_detail(obj.reply_to)
 
     def get_forward_from_detail(self, obj):
-        if obj.forward_from:
-            return {
-                "id": str(obj.forward_from.id),
-                "sender": str(obj.forward_from.sender.id) if obj.forward_from.sender else None,
-                "content": obj.forward_from.content,
-            }
-        return None
+        return self._flat_detail(obj.forward_from)
     
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# Chat Serializer
+# Message Forward Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageForwardSerializer(serializers.Serializer):
+    chats = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+    )
+
+    def validate_chats(self, value):
+        value = list(dict.fromkeys(value))
+        max_targets = getattr(settings, 'CHAT_FORWARD_MAX_TARGETS', 50)
+        if len(value) > max_targets:
+            raise serializers.ValidationError(f"حداکثر {max_targets} چت")
+        return value
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Bulk Membership Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class BulkMembershipSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    remove = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+
+    def validate(self, attrs):
+        add = list(dict.fromkeys(attrs['add']))
+        remove = list(dict.fromkeys(attrs['remove']))
+        if not add and not remove:
+            raise serializers.ValidationError("لیست add یا remove لازم است")
+        if set(add) & set(remove):
+            raise serializers.ValidationError("یک کاربر هم در add و هم در remove است")
+
+        max_members = getattr(settings, 'CHAT_BULK_MEMBERS_MAX', 1000)
+        if len(add) + len(remove) > max_members:
+            raise serializers.ValidationError(f"حداکثر {max_members} کاربر در هر درخواست")
+
+        # وجود همه‌ی کاربرها با یک کوئری
+        if add:
+            found = set(User.objects.filter(id__in=add, is_active=True).values_list('id', flat=True))
+            missing = [str(user_id) for user_id in add if user_id not in found]
+            if missing:
+                raise serializers.ValidationError({'add': [f"کاربر {user_id} پیدا نشد" for user_id in missing]})
+
+        attrs['add'], attrs['remove'] = add, remove
+        return attrs
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Message Search Serializer
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-class ChatSerializer:
-    member_count = serializers.SerializerMethodField()
-    members = ProfileSerializer(
-        source='membership_chat.user.profile_chat', 
-        many=True, read_only=True
+class MessageSearchSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = (
+            "id",
+            "chat",
+            "sender",
+            "snippet",
+            "rank",
+            "sent_at",
         )
+        read_only_fields = fields
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Message Realtime Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MessageRealtimeSerializer:
+    """
+    schema ثابت پیام‌های WebSocket بدون ماشین‌آلات DRF.
+    فقط ستون‌های خود پیام (*_id) خوانده می‌شوند، پس هیچ کوئری اضافه‌ای ندارد.
+    خروجی یک بار در زمان ارسال encode می‌شود و همان رشته به همه‌ی سوکت‌ها می‌رود.
+    """
+    fields = (
+        "type",
+        "id",
+        "chat",
+        "sender",
+        "content",
+        "voice",
+        "reply_to",
+        "thread_root",
+        "forward_from",
+        "is_edited",
+        "sent_at",
+        "seq",
+    )
+
+    @staticmethod
+    def _str(value):
+        return str(value) if value is not None else None
+
+    @classmethod
+    def to_dict(cls, message):
+        return {
+            "type": "message",
+            "id": str(message.id),
+            "chat": cls._str(message.chat_id),
+            "sender": cls._str(message.sender_id),
+            "content": message.content,
+            "voice": cls._str(message.voice_id),
+            "reply_to": cls._str(message.reply_to_id),
+            "thread_root": cls._str(message.thread_root_id),
+            "forward_from": cls._str(message.forward_from_id),
+            "is_edited": message.is_edited,
+            "sent_at": message.sent_at.isoformat(),
+            "seq": message.seq,
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        # ردیف write-behind که هنوز در دیتابیس نوشته نشده
+        return {
+            "type": "message",
+            "id": row['id'],
+            "chat": row['chat_id'],
+            "sender": row['sender_id'],
+            "content": row['content'],
+            "voice": row['voice_id'],
+            "reply_to": None,
+            "thread_root": None,
+            "forward_from": None,
+            "is_edited": False,
+            "sent_at": row['sent_at'],
+            "seq": row.get('seq'),
+        }
+
+    @staticmethod
+    def encode(payload):
+        return encode_frame(payload)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Chat Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ChatSerializer(serializers.ModelSerializer):
+    # از active_member_list که ChatViewSet با Prefetch می‌سازد؛ بدون کوئری برای هر چت
+    members = serializers.SerializerMethodField()
     
     class Meta:
         model = Chat
@@ -88,17 +354,28 @@ class ChatSerializer:
             "creator",
             "is_active",
             "member_count",
+            "message_count",
+            "last_message",
+            "last_activity_at",
             "members"
         )
         read_only_fields = fields
 
-    def get_member_count(self, obj):
-        return obj.active_memberships.count()
+    def get_members(self, obj):
+        memberships = getattr(obj, 'active_member_list', None)
+        if memberships is None:
+            memberships = obj.active_memberships.select_related('user__profile_chat')
+        profiles = [
+            membership.user.profile_chat
+            for membership in memberships
+            if membership.user is not None and hasattr(membership.user, 'profile_chat')
+        ]
+        return ProfileSerializer(profiles, many=True, context=self.context).data
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Members Serializer
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-class ChatMembershipSerializer(serializers.ModelSerializerizer):
+class ChatMembershipSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMembership
         fields = (
@@ -109,3 +386,36 @@ class ChatMembershipSerializer(serializers.ModelSerializerizer):
             "joined_at"
         )
         read_only_fields = fields
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Inbox Serializer
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class InboxSerializer(serializers.ModelSerializer):
+    """
+    هر ردیف یک عضویت است؛ unread_count در کوئری annotate شده است
+    """
+    chat_id = serializers.UUIDField(source='chat.id', read_only=True)
+    name = serializers.CharField(source='chat.name', read_only=True)
+    chat_type = serializers.CharField(source='chat.chat_type', read_only=True)
+    member_count = serializers.IntegerField(source='chat.member_count', read_only=True)
+    last_activity_at = serializers.DateTimeField(source='chat.last_activity_at', read_only=True)
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatMembership
+        fields = (
+            "chat_id",
+            "name",
+            "chat_type",
+            "member_count",
+            "last_activity_at",
+            "last_message",
+            "unread_count",
+            "last_read_message",
+            "last_read_at",
+        )
+        read_only_fields = fields
+
+    def get_last_message(self, obj):
+        return MessageSerializer._flat_detail(obj.chat.last_message)
@@ -0,0 +1,158 @@
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from notifications.models import Notifs
+from chat.models import (
+    Chat,
+    ChatUnreadCounter,
+    Message,
+    )
+
+User = get_user_model()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Helper function
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def notifs_batch_size():
+    return getattr(settings, 'CHAT_NOTIFS_BATCH_SIZE', 500)
+
+def bulk_create_notifs(user_ids, **fields):
+    """
+    ساخت ردیف‌های نوتیف در حافظه و نوشتن آن‌ها با bulk_create در چند batch
+    """
+    batch_size = notifs_batch_size()
+    batch = []
+    for user_id in user_ids:
+        batch.append(Notifs(user_id=user_id, **fields))
+        if len(batch) >= batch_size:
+            Notifs.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Notifs.objects.bulk_create(batch)
+
+def display_name(user):
+    return user.full_name or user.mobile
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Notification Tasks
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@shared_task(ignore_result=True)
+def notify_new_messages(message_ids):
+    """
+    پیام جدید: به جای یک نوتیف برای هر پیام، شمارنده‌ی خوانده‌نشده‌ی
+    هر عضو در هر چت به اندازه‌ی تعداد پیام‌های همان فرستنده بالا می‌رود
+    """
+    messages = Message.objects.filter(
+        id__in=message_ids,
+        chat__isnull=False,
+        sender__isnull=False
+    ).only('id', 'chat_id', 'sender_id', 'sent_at')
+
+    groups = {}
+    for message in messages:
+        groups.setdefault((message.chat_id, message.sender_id), []).append(message)
+
+    for (chat_id, sender_id), chat_messages in groups.items():
+        latest = max(chat_messages, key=lambda message: message.sent_at)
+        recipients = Chat(id=chat_id).active_memberships.exclude(
+            user_id=sender_id
+        ).values_list('user_id', flat=True)
+
+        ChatUnreadCounter.bump(
+            chat_id,
+            recipients.iterator(),
+            last_message_id=latest.id,
+            step=len(chat_messages),
+            batch_size=notifs_batch_size(),
+        )
+
+@shared_task(ignore_result=True)
+def notify_member_added(chat_id, user_id, added_by_id=None):
+    chat = Chat.objects.filter(id=chat_id).only('id', 'name').first()
+    user = User.objects.filter(id=user_id).first()
+    if chat is None or user is None:
+        return
+
+    if added_by_id:
+        added_by = User.objects.filter(id=added_by_id).first()
+        if added_by:
+            bulk_create_notifs(
+                [user.pk],
+                title="دعوت به چت",
+                notif_type="chat",
+                description=f"{added_by.full_name} شما را به چت '{chat.name}' دعوت کرد",
+                content_type=ContentType.objects.get_for_model(Chat),
+                object_id=chat.id,
+            )
+
+    members = chat.active_memberships.exclude(user_id=user.pk).values_list('user_id', flat=True)
+    bulk_create_notifs(
+        members.iterator(),
+        title="عضو جدید",
+        type="chat_member_added",
+        description=f"{display_name(user)} به چت '{chat.name}' اضافه شد"
+    )
+
+@shared_task(ignore_result=True)
+def notify_members_added(chat_id, user_ids, added_by_id=None):
+    """
+    اضافه شدن گروهی: یک دعوت برای هر کاربر جدید و فقط یک نوتیف خلاصه
+    ("N عضو جدید") برای هر عضو قبلی، به جای N نوتیف برای هر عضو
+    """
+    chat = Chat.objects.filter(id=chat_id).only('id', 'name').first()
+    if chat is None or not user_ids:
+        return
+
+    added_by = User.objects.filter(id=added_by_id).first() if added_by_id else None
+    if added_by:
+        bulk_create_notifs(
+            user_ids,
+            title="دعوت به چت",
+            notif_type="chat",
+            description=f"{added_by.full_name} شما را به چت '{chat.name}' دعوت کرد",
+            content_type=ContentType.objects.get_for_model(Chat),
+            object_id=chat.id,
+        )
+
+    if len(user_ids) == 1:
+        user = User.objects.filter(id=user_ids[0]).first()
+        description = f"{display_name(user)} به چت '{chat.name}' اضافه شد" if user else None
+    else:
+        description = f"{len(user_ids)} عضو جدید به چت '{chat.name}' اضافه شدند"
+    if description is None:
+        return
+
+    members = chat.active_memberships.exclude(user_id__in=user_ids).values_list('user_id', flat=True)
+    bulk_create_notifs(
+        members.iterator(),
+        title="عضو جدید",
+        type="chat_member_added",
+        description=description
+    )
+
+@shared_task(ignore_result=True)
+def notify_members_removed(chat_id, user_ids):
+    chat = Chat.objects.filter(id=chat_id).only('id', 'name').first()
+    if chat is None:
+        return
+
+    bulk_create_notifs(
+        user_ids,
+        title="حذف از چت",
+        type="chat_removed",
+        description=f"شما از چت '{chat.name}' حذف شدید"
+    )
+
+@shared_task(ignore_result=True)
+def notify_member_removed(chat_id, user_id):
+    chat = Chat.objects.filter(id=chat_id).only('id', 'name').first()
+    if chat is None:
+        return
+
+    bulk_create_notifs(
+        [user_id],
+        title="حذف از چت",
+        type="chat_removed",
+        description=f"شما از چت '{chat.name}' حذف شدید"
+    )
@@ -13,6 +13,7 @@ message_list = views.MessageViewSet.as_view({
 router.register(r'profiles', views.ProfileViewSet, basename='profile')
 router.register(r'chats', views.ChatViewSet, basename='chat')
 router.register(r'messages', views.MessageViewSet, basename='message')
+router.register(r'voices', views.VoiceNoteViewSet, basename='voice')
 
 urlpatterns = [
     path('', include(router.urls)),
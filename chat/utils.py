@@ -1,7 +1,11 @@
+import asyncio
 import uuid
 import zipfile
 import mimetypes
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 import jdatetime
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -39,3 +43,62 @@ def validate_attachment_file(value):
 def generate_ticket_number():
     year = jdatetime.date.today().year
     return f"{year}-{uuid.uuid4().hex[:8]}"
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Channel-layer helpers
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def chat_group_name(chat_id):
+    return f'chat_{chat_id}'
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+def admin_count_cache_key(chat_id):
+    return f'chat:admins:{chat_id}'
+
+def notify_membership_change(chat_id, user_id):
+    """
+    پیام کنترلی به گروه کاربر تا سوکت‌های باز او (ChatConsumer و UserConsumer
+    هر دو عضو user_<id> هستند) کش عضویت را دوباره بخوانند
+    """
+    cache.delete(admin_count_cache_key(chat_id))
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    event = {
+        'type': 'membership_changed',
+        'chat_id': str(chat_id),
+        'user_id': str(user_id),
+    }
+    async_to_sync(channel_layer.group_send)(user_group_name(user_id), event)
+
+def notify_members_change(chat_id, user_ids):
+    """
+    نسخه‌ی گروهی: یک رویداد با لیست user_ids به گروه هر کاربر تغییر کرده
+    """
+    cache.delete(admin_count_cache_key(chat_id))
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not user_ids:
+        return
+
+    event = {
+        'type': 'membership_changed',
+        'chat_id': str(chat_id),
+        'user_ids': [str(user_id) for user_id in user_ids],
+    }
+
+    async def send_all():
+        await asyncio.gather(*(
+            channel_layer.group_send(user_group_name(user_id), event)
+            for user_id in event['user_ids']
+        ))
+
+    async_to_sync(send_all)()
+
+def membership_event_affects(event, user_id):
+    """رویداد membership_changed تکی (user_id) یا گروهی (user_ids)"""
+    user_ids = event.get('user_ids') or [event.get('user_id')]
+    return str(user_id) in user_ids
@@ -1,20 +1,49 @@
 from rest_framework import viewsets
 from rest_framework import generics
+from rest_framework import mixins
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied as DjangoPermissionDenied
+from django.db.models import Exists, F, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from chat.models import (
     Chat, 
+    ChatMembership,
+    ChatUnreadCounter,
     Message, 
     Profile, 
+    VoiceNote,
     )
 from chat.serializers import (
+    BulkMembershipSerializer,
     ChatSerializer,
+    InboxSerializer,
+    MessageForwardSerializer,
+    MessageRealtimeSerializer,
+    MessageSearchSerializer,
     MessageSerializer,
     ProfileSerializer, 
+    VoiceNoteSerializer,
     )
+from chat.archive import has_archived_messages
+from chat.broadcast import broadcast_messages
+from chat.history_cache import history_cache, history_size
+from chat.media import ranged_file_response
+from chat.membership import MembershipSnapshot
+from chat.presence import get_online_members
+from chat.replay import append_message
+from chat.pagination import MessageKeysetPagination, SearchKeysetPagination
+from chat.search import search_messages
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+from django.db import transaction
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from rest_framework.exceptions import PermissionDenied
 
 User = get_user_model()
@@ -38,19 +67,76 @@ class ChatViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        # فقط چت‌هایی که کاربر عضو فعالش هست
-        return Chat.objects.filter(
-            membership_chat__user=self.request.user,
-            membership_chat__is_active=True
-        ).distinct()
+        # فقط چت‌هایی که کاربر عضو فعالش هست؛ EXISTS روی member_active_user_chat_idx
+        # به جای JOIN + DISTINCT روی کل جدول member
+        is_member = ChatMembership.objects.filter(
+            chat=OuterRef('pk'),
+            user=self.request.user,
+            is_active=True
+        )
+        queryset = Chat.objects.filter(Exists(is_member))
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'membership_chat',
+                queryset=ChatMembership.objects.filter(
+                    is_active=True
+                ).select_related('user__profile_chat'),
+                to_attr='active_member_list',
+            ))
+        return queryset
 
     def perform_create(self, serializer):
         chat = serializer.save(creator=self.request.user)
         chat.create_creator_membership()
 
+    @action(detail=False, methods=["get"])
+    def inbox(self, request):
+        """
+        چت‌های کاربر به ترتیب آخرین فعالیت همراه با تعداد خوانده‌نشده، در یک کوئری
+        """
+        unread = ChatUnreadCounter.objects.filter(
+            chat=OuterRef('chat'),
+            user=OuterRef('user')
+        ).values('unread_count')[:1]
+
+        memberships = ChatMembership.objects.filter(
+            user=request.user,
+            is_active=True,
+            chat__is_active=True
+        ).select_related(
+            'chat',
+            'chat__last_message',
+        ).annotate(
+            unread_count=Coalesce(Subquery(unread), 0)
+        ).order_by(
+            F('chat__last_activity_at').desc(nulls_last=True)
+        )
+
+        serializer = InboxSerializer(memberships, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["get"])
+    def online(self, request, pk=None):
+        # snapshot اعضای آنلاین از Redis
+        chat = self.get_object()
+        return Response({"online": get_online_members(chat.id)})
+
+    @cached_property
+    def membership(self):
+        """عضویت کاربر در چت همین درخواست؛ یک کوئری برای همه‌ی بررسی‌های نقش"""
+        snapshot = MembershipSnapshot.load(self.kwargs['pk'], self.request.user)
+        if snapshot is None:
+            raise Http404
+        return snapshot
+
+    def admin_membership(self):
+        if not self.membership.can_manage_members():
+            raise PermissionDenied("فقط ادمین می‌تواند اعضا را مدیریت کند")
+        return self.membership
+
     @action(detail=True, methods=["post"])
     def add_member(self, request, pk=None):
-        chat = self.get_object()
+        chat = self.membership.chat
         user_id = request.data.get("user_id")
         user = get_object_or_404(User, id=user_id)
         success = chat.add_member(user, added_by=request.user)
@@ -58,38 +144,212 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=["post"])
     def remove_member(self, request, pk=None):
-        chat = self.get_object()
+        chat = self.membership.chat
         user_id = request.data.get("user_id")
         user = get_object_or_404(User, id=user_id)
         success = chat.remove_member(user)
         return Response({"success": success})
 
+    @action(detail=True, methods=["post"], url_path="members/bulk")
+    def bulk_members(self, request, pk=None):
+        """
+        اضافه/حذف گروهی اعضا: {"add": [user_id, ...], "remove": [user_id, ...]}
+        همه در یک تراکنش؛ رویداد و نوتیف‌ها بعد از commit
+        """
+        membership = self.admin_membership()
+        chat = membership.chat
+
+        serializer = BulkMembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add, remove = serializer.validated_data['add'], serializer.validated_data['remove']
+
+        # بررسی سریع از snapshot؛ بررسی قطعی زیر قفل چت در remove_members است
+        if request.user.pk in remove and not membership.can_remove_admin():
+            raise PermissionDenied("آخرین ادمین نمی‌تواند خودش را حذف کند")
+        try:
+            with transaction.atomic():
+                added = chat.add_members(add, added_by=request.user) if add else 0
+                removed = chat.remove_members(remove, keep_admin=True) if remove else 0
+        except DjangoPermissionDenied as error:
+            raise PermissionDenied(str(error))
+        return Response({"added": added, "removed": removed})
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Message ViewSet
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessageKeysetPagination
 
     def get_queryset(self):
         # برای PATCH/PUT/DELETE فقط پیام خودش پیدا می‌شود
         queryset = Message.objects.filter(
             chat__membership_chat__user=self.request.user,
             chat__membership_chat__is_active=True
-        ).order_by('sent_at')
+        ).select_related(
+            'sender__profile_chat',
+            'reply_to',
+            'forward_from',
+            'voice',
+        ).only(
+            *MessageSerializer.QUERYSET_FIELDS
+        )
 
-        # اگر query param chat مشخص شد، فقط پیام‌های آن چت را برمی‌گرداند
-        chat_id = self.request.query_params.get('chat')
+        # اگر chat در مسیر (chats-messages) یا query param مشخص شد، فقط پیام‌های آن چت
+        chat_id = self.kwargs.get('chat_id') or self.request.query_params.get('chat')
         if chat_id:
             queryset = queryset.filter(chat__id=chat_id)
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        cached = self.list_from_history_cache(request)
+        if cached is not None:
+            return cached
+        return super().list(request, *args, **kwargs)
+
+    def list_from_history_cache(self, request):
+        """
+        صفحه‌ی اول تاریخچه‌ی یک چت (بدون cursor) از history_cache با یک round-trip؛
+        در miss لیست از دیتابیس ساخته و برای اعضای بعدی نگه داشته می‌شود
+        """
+        params = request.query_params
+        if params.get(self.paginator.before_query_param) or params.get(self.paginator.after_query_param):
+            return None
+        limit = self.paginator.get_limit(request)
+        if limit > history_size():
+            return None
+        chat_id = self.archive_chat_id
+        if not chat_id:
+            return None
+
+        entries = history_cache.get(chat_id)
+        if entries is None:
+            entries = history_cache.fill(chat_id, self.get_queryset())
+            if entries is None:
+                return None
+
+        # لیست کوتاه‌تر از K + 1 کل جدول زنده است؛ اگر صفحه به ابتدای آن برسد
+        # فقط وقتی چت آرشیو دارد ادامه از مسیر معمول (archived_rows) خوانده می‌شود
+        page = entries[-limit:]
+        has_older = len(entries) > limit
+        if not has_older and has_archived_messages(chat_id):
+            return None
+        return Response({
+            'before': page[0]['cursor'] if has_older else None,
+            'after': page[-1]['cursor'],
+            'has_older': has_older,
+            'has_newer': False,
+            'results': [MessageSerializer.absolute_urls(entry['data'], request) for entry in page],
+        })
+
+    @cached_property
+    def archive_chat_id(self):
+        """چتی که صفحه‌بندی تاریخچه بعد از جدول زنده از آرشیو آن می‌خواند"""
+        chat_id = self.kwargs.get('chat_id') or self.request.query_params.get('chat')
+        if self.action != 'list' or not chat_id:
+            return None
+        is_member = ChatMembership.objects.filter(
+            chat_id=chat_id,
+            user=self.request.user,
+            is_active=True
+        ).exists()
+        return chat_id if is_member else None
+
+    @action(detail=True, methods=["get"])
+    def thread(self, request, pk=None):
+        """
+        کل رشته‌ی پاسخ‌های یک پیام (از هر عضو رشته) با یک کوئری روی
+        chat_message_thread_idx و صفحه‌بندی keyset؛ بدون پیمایش reply_to
+        """
+        message = self.get_object()
+        root_id = message.thread_root_id or message.id
+        root = message if root_id == message.id else get_object_or_404(self.get_queryset(), pk=root_id)
+
+        queryset = Message.objects.thread(root.id).filter(
+            chat_id=root.chat_id
+        ).select_related(
+            'sender__profile_chat',
+            'reply_to',
+            'forward_from',
+            'voice',
+        ).only(
+            *MessageSerializer.QUERYSET_FIELDS
+        )
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['root'] = self.get_serializer(root).data
+        return response
+
+    @action(detail=True, methods=["post"])
+    def forward(self, request, pk=None):
+        """
+        فوروارد یک پیام به چند چت: یک کوئری برای بررسی عضویت همه‌ی مقصدها،
+        یک bulk_create و یک گذر ارسال realtime بعد از commit
+        """
+        source = self.get_object()
+        serializer = MessageForwardSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        chat_ids = serializer.validated_data['chats']
+
+        chats = list(Chat.objects.filter(
+            id__in=chat_ids,
+            is_active=True,
+            membership_chat__user=request.user,
+            membership_chat__is_active=True
+        ).only('id'))
+        if len(chats) != len(chat_ids):
+            raise PermissionDenied("اجازه ارسال پیام به همه‌ی چت‌ها را ندارید")
+
+        with transaction.atomic():
+            messages = Message.forward(source, request.user, chats)
+
+        # frame محتوای پیام اصلی را دارد؛ ردیف ذخیره شده فقط ارجاع است
+        origin = messages[0].forward_from
+        realtime = []
+        for chat, message in zip(chats, messages):
+            payload = MessageRealtimeSerializer.to_dict(message)
+            payload['content'] = origin.content
+            realtime.append((chat.id, payload))
+        transaction.on_commit(
+            lambda: async_to_sync(broadcast_messages)(get_channel_layer(), realtime)
+        )
+
+        return Response(
+            self.get_serializer(messages, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        """
+        جستجوی full-text در چت‌های کاربر (اختیاری: ?chat=) با rank و snippet
+        """
+        term = (request.query_params.get('q') or '').strip()
+        if not term:
+            return Response({"after": None, "results": []})
+
+        queryset = Message.objects.filter(
+            chat__membership_chat__user=request.user,
+            chat__membership_chat__is_active=True
+        ).only('id', 'chat_id', 'sender_id', 'content', 'sent_at')
+        chat_id = request.query_params.get('chat')
+        if chat_id:
+            queryset = queryset.filter(chat__id=chat_id)
+
+        paginator = SearchKeysetPagination()
+        page = paginator.paginate_queryset(search_messages(queryset, term), request, view=self)
+        serializer = MessageSearchSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     def perform_create(self, serializer):
         chat = serializer.validated_data['chat']
-        if not chat.can_message(self.request.user):
+        membership = MembershipSnapshot.load(chat.pk, self.request.user)
+        if membership is None or not membership.can_message():
             raise PermissionDenied("اجازه ارسال پیام ندارید")
-        serializer.save(sender=self.request.user)
+        message = serializer.save(sender=self.request.user)
+        transaction.on_commit(lambda: append_message(message))
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Message Create View
@@ -99,10 +359,43 @@ class MessageCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        chat_id = self.kwargs.get('chat_id')
-        chat = get_object_or_404(Chat, id=chat_id)
-
-        if not chat.can_message(self.request.user):
+        membership = MembershipSnapshot.load(self.kwargs.get('chat_id'), self.request.user)
+        if membership is None or not membership.can_message():
             raise PermissionDenied("اجازه ارسال پیام ندارید")
 
-        serializer.save(sender=self.request.user, chat=chat)
\ No newline at end of file
+        message = serializer.save(sender=self.request.user, chat=membership.chat)
+        transaction.on_commit(lambda: append_message(message))
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Voice Note ViewSet
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class VoiceNoteViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet
+    ):
+    serializer_class = VoiceNoteSerializer
+    permission_classes = [IsAuthenticated]
+    # آپلود به صورت stream در فایل موقت نوشته می‌شود و یک بار به storage می‌رود
+    parser_classes = [MultiPartParser]
+
+    def get_queryset(self):
+        # فایل‌های خود کاربر یا فایل‌هایی که در چت‌های او ارسال شده‌اند
+        shared_with_user = Message.objects.filter(
+            voice=OuterRef('pk'),
+            chat__in=ChatMembership.objects.filter(
+                user=self.request.user,
+                is_active=True
+            ).values('chat')
+        )
+        return VoiceNote.objects.filter(
+            Q(uploader=self.request.user) | Exists(shared_with_user)
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(uploader=self.request.user)
+
+    @action(detail=True, methods=["get"])
+    def stream(self, request, pk=None):
+        voice = self.get_object()
+        return ranged_file_response(request, voice.file, voice.size, voice.content_type)
@@ -12,22 +12,27 @@ SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
 #---------------------------------------------
 # Application definition
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'drf_spectacular',
     'corsheaders',
     'rest_framework',
     'django_filters',
+    'channels',
     'post',
+    'chat',
 ]
 #---------------------------------------------
 MIDDLEWARE = [
     'django_currentuser.middleware.ThreadLocalUserMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'chat.metrics.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +61,25 @@ TEMPLATES = [
 ]
 #---------------------------------------------
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+#---------------------------------------------
+# Channels
+CHANNEL_REDIS_URL = os.getenv("CHANNEL_REDIS_URL")
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [CHANNEL_REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 #---------------------------------------------
 # Database
 DATABASES = {
@@ -89,6 +113,39 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        # JSONRenderer با اندازه‌گیری زمان serialize (chat.metrics)
+        'chat.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+#---------------------------------------------
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'pythonjsonlogger.json.JsonFormatter',
+            'fmt': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv("LOG_LEVEL", "INFO"),
+    },
+    'loggers': {
+        'chat.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 #---------------------------------------------
 LANGUAGE_CODE = 'en-us'
@@ -100,10 +157,83 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# فایل‌های صوتی چت: FileSystemStorage به صورت پیش‌فرض، S3 با django-storages
+STORAGES = {
+    "default": {
+        "BACKEND": os.getenv("MEDIA_STORAGE_BACKEND", "django.core.files.storage.FileSystemStorage"),
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
 #---------------------------------------------
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+#---------------------------------------------
+# Cache (django-redis در production تا کش بین workerها مشترک باشد)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+#---------------------------------------------
+# Celery
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_TASK_IGNORE_RESULT = True
+
+#---------------------------------------------
+# Chat
+CHAT_NOTIFS_BATCH_SIZE = int(os.getenv("CHAT_NOTIFS_BATCH_SIZE", 500))
+# write-behind: پیام‌های WebSocket قبل از ذخیره broadcast و به صورت batch نوشته می‌شوند
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_WRITE_BEHIND_FLUSH_MS = int(os.getenv("CHAT_WRITE_BEHIND_FLUSH_MS", 50))
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", 200))
+CHAT_WRITE_BEHIND_MAX_PENDING = int(os.getenv("CHAT_WRITE_BEHIND_MAX_PENDING", 5000))
+CHAT_WRITE_BEHIND_STREAM_URL = os.getenv("CHAT_WRITE_BEHIND_STREAM_URL")
+CHAT_WRITE_BEHIND_HEARTBEAT_TTL = int(os.getenv("CHAT_WRITE_BEHIND_HEARTBEAT_TTL", 30))
+# شمارنده‌ی seq هر چت در Redis (بدون آدرس: UPDATE روی جدول چت)
+CHAT_SEQ_REDIS_URL = os.getenv("CHAT_SEQ_REDIS_URL", CHAT_WRITE_BEHIND_STREAM_URL)
+CHAT_VOICE_MAX_BYTES = int(os.getenv("CHAT_VOICE_MAX_BYTES", 10 * 1024 * 1024))
+CHAT_READ_DEBOUNCE_MS = int(os.getenv("CHAT_READ_DEBOUNCE_MS", 1000))
+# presence و typing فقط در Redis (بدون آدرس غیرفعال است)
+CHAT_PRESENCE_REDIS_URL = os.getenv("CHAT_PRESENCE_REDIS_URL", CHANNEL_REDIS_URL)
+CHAT_PRESENCE_TTL = int(os.getenv("CHAT_PRESENCE_TTL", 60))
+CHAT_TYPING_INTERVAL_MS = int(os.getenv("CHAT_TYPING_INTERVAL_MS", 2000))
+CHAT_ADMIN_COUNT_CACHE_TTL = int(os.getenv("CHAT_ADMIN_COUNT_CACHE_TTL", 300))
+# صفحه‌ی اول تاریخچه‌ی هر چت (آخرین K پیام serialize شده) در cache پیش‌فرض
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", 50))
+CHAT_HISTORY_CACHE_TTL = int(os.getenv("CHAT_HISTORY_CACHE_TTL", 10 * 60))
+CHAT_FORWARD_MAX_TARGETS = int(os.getenv("CHAT_FORWARD_MAX_TARGETS", 50))
+CHAT_BULK_MEMBERS_MAX = int(os.getenv("CHAT_BULK_MEMBERS_MAX", 1000))
+# کانال‌ها و گروه‌های بزرگ‌تر از این حد با یک publish به ازای هر پیام ارسال می‌شوند
+CHAT_BROADCAST_MIN_MEMBERS = int(os.getenv("CHAT_BROADCAST_MIN_MEMBERS", 1000))
+CHAT_BROADCAST_REDIS_URL = os.getenv("CHAT_BROADCAST_REDIS_URL", CHANNEL_REDIS_URL)
+# replay buffer برای resume سوکت‌ها (بدون Redis فقط درون همان worker)
+CHAT_REPLAY_REDIS_URL = os.getenv("CHAT_REPLAY_REDIS_URL", CHANNEL_REDIS_URL)
+CHAT_REPLAY_BUFFER_SIZE = int(os.getenv("CHAT_REPLAY_BUFFER_SIZE", 500))
+CHAT_REPLAY_TTL = int(os.getenv("CHAT_REPLAY_TTL", 24 * 60 * 60))
+CHAT_RESUME_MAX_MESSAGES = int(os.getenv("CHAT_RESUME_MAX_MESSAGES", 500))
+# gzip یا zstd؛ خالی یعنی zstd در صورت نصب بودن zstandard
+CHAT_ARCHIVE_COMPRESSION = os.getenv("CHAT_ARCHIVE_COMPRESSION", "")
+# نسبت درخواست‌ها/رویدادهای نمونه‌برداری شده (0 تا 1) و توکن endpoint متریک‌ها
+CHAT_METRICS_SAMPLE_RATE = float(os.getenv("CHAT_METRICS_SAMPLE_RATE", 0.0))
+CHAT_METRICS_TOKEN = os.getenv("CHAT_METRICS_TOKEN", "")
+
 
 #SWAGGER
 SPECTACULAR_SETTINGS = {
@@ -9,9 +9,11 @@ from django.urls import path,include
 from django.conf.urls.static import static
 from config import settings
 import debug_toolbar
+from chat.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 urlpatterns += [